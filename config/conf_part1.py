@@ -22,6 +22,14 @@ internal_input          = 1
 
 mask_pattern            = '*.nii.gz'
 
+# Cases processed at the same time, each one by its own process with its own plugins stack (1 means sequential).
+# With the 'parallel' strategy, radiomicNCores is lowered so that caseWorkers x radiomicNCores fits in the CPUs.
+caseWorkers             = 1
+workQueuePath           = None          # shared directory to claim the cases from several processes or nodes (None disables it)
+workQueueStaleTime      = 3600          # seconds without heartbeat before a claimed case is re-queued
+prefetchCases           = 0             # next cases read in background while the current one is processed, each one kept in memory (0 disables it). Only in a sequential run: ignored with workQueuePath or caseWorkers > 1
+timingReport            = None          # JSON file with the wall, cpu and children cpu times and peak RSS of each case and plugin (None disables it)
+
 # OUTPUT PATHS
 dst_image_path          = "/home/willytell/Escritorio/LungCTDataBase/preprocessed/Nii_Vol/CTRoi_nii"
 dst_mask_path           = "/home/willytell/Escritorio/LungCTDataBase/preprocessed/Nii_Vol/CTRoimask_nii_part1"
@@ -29,6 +37,9 @@ dst_mask_path           = "/home/willytell/Escritorio/LungCTDataBase/preprocesse
 
 # Labeling
 labeling_se_dim         = '(3, 3, 3)'   # Labeling structure_element dimension
+labeling_crop           = True          # label only the bounding box of the foreground (same labels, less time and memory)
+component_min_volume    = 0             # components with less voxels are neither expanded nor saved
+component_max_count     = None          # keep only the n largest components (None keeps all of them)
 
 # TODO: set variables by plugin.
 # Strategy to expand the VolumeBBox
@@ -17,6 +17,14 @@ internal_input          = 2
 
 mask_pattern            = '*.nii.gz'
 
+# Cases processed at the same time, each one by its own process with its own plugins stack (1 means sequential).
+# With the 'parallel' strategy, radiomicNCores is lowered so that caseWorkers x radiomicNCores fits in the CPUs.
+caseWorkers             = 1
+workQueuePath           = None          # shared directory to claim the cases from several processes or nodes (None disables it)
+workQueueStaleTime      = 3600          # seconds without heartbeat before a claimed case is re-queued
+prefetchCases           = 0             # next cases read in background while the current one is processed, each one kept in memory (0 disables it). Only in a sequential run: ignored with workQueuePath or caseWorkers > 1
+timingReport            = None          # JSON file with the wall, cpu and children cpu times and peak RSS of each case and plugin (None disables it)
+
 # OUTPUT PATHS
 dst_image_path          = None
 dst_mask_path           = None
@@ -24,6 +32,9 @@ dst_mask_path           = None
 
 # Labeling
 labeling_se_dim         = '(3, 3, 3)'   # Labeling structure_element dimension
+labeling_crop           = True          # label only the bounding box of the foreground (same labels, less time and memory)
+component_min_volume    = 0             # components with less voxels are neither expanded nor saved
+component_max_count     = None          # keep only the n largest components (None keeps all of them)
 
 # Strategy to expand the VolumeBBox
 # UniformExpansion
@@ -59,8 +70,22 @@ mode                    = 'edge'        # ['constant'|'edge'|'mean'| etc.] Look
 
 # Radiomic
 radiomicConfigFile      = "/home/gtorres/Documentos/PhD/lc3d/config/Params.yaml"
+radiomicStrategy        = 'parallel'    # ['serial' | 'parallel' | 'vectorized'] to use pyradiomics in one or n cores, or NumPy batches
 #radiomicLogPath         = "/home/gtorres/Documentos/PhD/lc3d/log"
 radiomicNCores          = 44            # n cores to use in parallel
+radiomicChunkSize       = 64            # n windows per task sent to the pool (1 means a task per window)
+checkpointPath          = None          # directory of the partial results of each case of the 'parallel' strategy (None disables it)
+checkpointInterval      = 300           # seconds between two checkpoints of a case
+vectorizedChunkSize     = 4096          # n windows computed at once by the 'vectorized' strategy
+globalDiscretization    = True          # discretize the whole volume once per case ('vectorized' strategy, only with binWidth)
+slidingFirstOrder       = True          # update the first order histograms window by window (needs deltas of 1 and binWidth)
+slidingGLCM             = True          # update the co-occurrence counts window by window (needs deltas of 1, binWidth and at most 32 gray levels)
+windowHalo              = None          # None: evaluate every window; N: only the windows centred in the mask dilated N voxels
+windowMemoSize          = 10000         # n identical windows memoized per case by the 'serial' and 'parallel' strategies (0 disables it)
+featureDtype            = 'float32'     # ['float32' | 'float64'] dtype of the columns of features
+featureClassProfile     = False         # report the seconds spent in each feature class at the end of each case
+featureCachePath        = None          # directory to cache the features of each case on disk (None disables it)
+featureCacheMaxSize     = 10 * 1024 ** 3  # max bytes of the feature cache, the least recently used cases are removed
 
 # Radiomic output file and its config
 radiomicOutputPath      = "/home/gtorres/Documentos/PhD/lc3d/output"
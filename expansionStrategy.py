@@ -1,28 +1,103 @@
 import numpy as np
+from scipy import ndimage
 from random import randint, random
 
 from abc import ABC, abstractmethod
 
+
+def summed_volume(mask):
+    """
+    Summed-volume table of a boolean volume, padded with a leading plane of zeros in each axis:
+    table[x, y, z] = mask[:x, :y, :z].sum().
+    """
+    dtype = np.int32 if mask.size < np.iinfo(np.int32).max else np.int64
+    table = np.zeros([n + 1 for n in mask.shape], dtype=dtype)
+    table[1:, 1:, 1:] = mask
+    for axis in range(3):
+        np.cumsum(table, axis=axis, out=table)
+    return table
+
+
+def box_sum(table, origin, vbbox):
+    # Sum of the voxels inside vbbox = [xmin, xmax, ymin, ymax, zmin, zmax] of the table built for the volume whose
+    # first voxel is at origin = [xmin, _, ymin, _, zmin, _]. The part of vbbox outside of that volume counts 0.
+    if table is None:
+        return 0
+
+    lo, hi = [], []
+    for axis in range(3):
+        lo.append(min(max(vbbox[2 * axis] - origin[2 * axis], 0), table.shape[axis] - 1))
+        hi.append(min(max(vbbox[2 * axis + 1] - origin[2 * axis] + 1, 0), table.shape[axis] - 1))
+        if hi[axis] <= lo[axis]:
+            return 0
+
+    return int(table[hi[0], hi[1], hi[2]] - table[lo[0], hi[1], hi[2]] - table[hi[0], lo[1], hi[2]]
+               - table[hi[0], hi[1], lo[2]] + table[lo[0], lo[1], hi[2]] + table[lo[0], hi[1], lo[2]]
+               + table[hi[0], lo[1], lo[2]] - table[lo[0], lo[1], lo[2]])
+
 class ExpansionStrategy(ABC):
     def __init__(self, name):
         self.name = name
+        self.tables_volume = None       # labeled volume of the summed-volume tables below (see build_tables()).
+        self.foreground_bbox = None     # [xmin, xmax, ymin, ymax, zmin, zmax] of all the labels.
+        self.foreground_table = None    # summed-volume table of labeled != 0 inside foreground_bbox.
+        self.label_slices = None        # bounding box of each label, from ndimage.find_objects().
+        self.label_tables = {}          # {label: summed-volume table of labeled == label inside its bounding box}
         super().__init__()
 
-    # count = np.zeros(ncomponents + 1)
-    def count_all_labels(self, volume, ncomponents, count):
-        # print("volume.max: {}".format(volume.max()))
-        # print("volume.min: {}".format(volume.min()))
-        #
-        # unique, counts = np.unique(volume, return_counts=True)
-        # print("unique : {}".format(unique))
-        # print("counts : {}".format(counts))
+    def build_tables(self, labeled, ncomponents):
+        """
+        Summed-volume tables (the 3D integral image) of the labeled volume, they are built once per case: any vbbox
+        query is then answered with the 8 corners of the table instead of counting its voxels. Outside of the bounding
+        box of the foreground every voxel is background, then the table covers only that bounding box (less memory).
+        """
+        self.tables_volume = labeled
+        self.label_tables = {}
+        self.label_slices = ndimage.find_objects(labeled, max_label=ncomponents)
+
+        slices = [s for s in self.label_slices if s is not None]
+        if len(slices) == 0:
+            self.foreground_bbox = None
+            self.foreground_table = None
+            return
+
+        # The bounding box of the foreground is the union of the ones of the labels.
+        self.foreground_bbox = []
+        for axis in range(3):
+            self.foreground_bbox += [min(s[axis].start for s in slices), max(s[axis].stop for s in slices) - 1]
+        b = self.foreground_bbox
+        self.foreground_table = summed_volume(labeled[b[0]:b[1] + 1, b[2]:b[3] + 1, b[4]:b[5] + 1] != 0)
+
+    def label_table(self, labeled, label_number):
+        # Summed-volume table of one label inside its own bounding box, built the first time it is needed.
+        if label_number not in self.label_tables:
+            slices = self.label_slices[label_number - 1] if label_number <= len(self.label_slices) else None
+            if slices is None:
+                self.label_tables[label_number] = (None, None)
+            else:
+                bbox = [v for s in slices for v in (s.start, s.stop - 1)]
+                self.label_tables[label_number] = (bbox, summed_volume(labeled[slices] == label_number))
+        return self.label_tables[label_number]
+
+    def count_box(self, labeled, vbbox, label_number, ncomponents=None):
+        """
+        Return (background, label, other labels): the amount of voxels of each kind inside vbbox = [xmin, xmax, ymin,
+        ymax, zmin, zmax], in constant time from the summed-volume tables of the labeled volume.
+        """
+        if self.tables_volume is not labeled:      # a new case, the tables of the previous one are not valid.
+            self.build_tables(labeled, int(labeled.max()) if ncomponents is None else ncomponents)
+
+        total = (vbbox[1] - vbbox[0] + 1) * (vbbox[3] - vbbox[2] + 1) * (vbbox[5] - vbbox[4] + 1)
+        foreground = box_sum(self.foreground_table, self.foreground_bbox, vbbox)
+        label_bbox, table = self.label_table(labeled, label_number)
+        label = box_sum(table, label_bbox, vbbox)
 
-        for l in range(0, ncomponents + 1):  # include the label '0' that corresponds to background.
-            count[l] = len(np.where(volume == l)[0])
+        return total - foreground, label, foreground - label
 
-    def one_label_present(self, count, label_number):
+    def one_label_present(self, labeled, vbbox, label_number, ncomponents=None):
         assert label_number != 0, "UniformExpansion, one_label_present does not verify the background label."
-        if count[label_number] == count[1:].sum():  # background is discarded
+        _, _, others = self.count_box(labeled, vbbox, label_number, ncomponents)
+        if others == 0:  # background is discarded
             # print("The label {} is the only one present in the volume.".format(label_number))
             return True
         else:
@@ -36,14 +111,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[0]:
             if lowest_idx_x <= (vbbox[0] - nvoxel):
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[(vbbox[0]-nvoxel):vbbox[1]+1, vbbox[2]:vbbox[3]+1, vbbox[4]:vbbox[5]+1]
-                self.count_all_labels(volume, ncomponents, count)
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0] - nvoxel, vbbox[1], vbbox[2], vbbox[3], vbbox[4], vbbox[5]], label_number, ncomponents):
                     vbbox[0] -= nvoxel
                 else:
                     growth_xyz[0] = False
-                del count
             else:
                 growth_xyz[0] = False
 
@@ -55,23 +126,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[1]:
             if (vbbox[1] + nvoxel) < higest_idx_x:
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[vbbox[0]:(vbbox[1] + nvoxel + 1), vbbox[2]:(vbbox[3] + 1), vbbox[4]:(vbbox[5] + 1)]
-                self.count_all_labels(volume, ncomponents, count)
-
-
-                print(volume[50:60, 50:60, :])
-
-                unique, counts = np.unique(volume, return_counts=True)
-                print("unique : {}".format(unique))
-                print("counts : {}".format(counts))
-
-
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0], vbbox[1] + nvoxel, vbbox[2], vbbox[3], vbbox[4], vbbox[5]], label_number, ncomponents):
                     vbbox[1] += nvoxel
                 else:
                     growth_xyz[1] = False
-                del count
             else:
                 growth_xyz[1] = False
 
@@ -82,14 +140,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[2]:
             if lowest_idx_y <= (vbbox[2] - nvoxel):
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[vbbox[0]:(vbbox[1] + 1), (vbbox[2] - nvoxel):(vbbox[3] + 1), vbbox[4]:(vbbox[5] + 1)]
-                self.count_all_labels(volume, ncomponents, count)
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0], vbbox[1], vbbox[2] - nvoxel, vbbox[3], vbbox[4], vbbox[5]], label_number, ncomponents):
                     vbbox[2] -= nvoxel
                 else:
                     growth_xyz[2] = False
-                del count
             else:
                 growth_xyz[2] = False
 
@@ -100,14 +154,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[3]:
             if (vbbox[3] + nvoxel) < higest_idx_y:
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[vbbox[0]:(vbbox[1] + 1), vbbox[2]:(vbbox[3] + nvoxel + 1), vbbox[4]:(vbbox[5] + 1)]
-                self.count_all_labels(volume, ncomponents, count)
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0], vbbox[1], vbbox[2], vbbox[3] + nvoxel, vbbox[4], vbbox[5]], label_number, ncomponents):
                     vbbox[3] += nvoxel
                 else:
                     growth_xyz[3] = False
-                del count
             else:
                 growth_xyz[3] = False
 
@@ -118,14 +168,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[4]:
             if lowest_idx_z <= (vbbox[4] - nvoxel):
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[vbbox[0]:(vbbox[1] + 1), vbbox[2]:(vbbox[3] + 1), (vbbox[4] - nvoxel):(vbbox[5] + 1)]
-                self.count_all_labels(volume, ncomponents, count)
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0], vbbox[1], vbbox[2], vbbox[3], vbbox[4] - nvoxel, vbbox[5]], label_number, ncomponents):
                     vbbox[4] -= nvoxel
                 else:
                     growth_xyz[4] = False
-                del count
             else:
                 growth_xyz[4] = False
 
@@ -136,14 +182,10 @@ class ExpansionStrategy(ABC):
 
         if growth_xyz[5]:
             if (vbbox[5] + nvoxel) < higest_idx_z:
-                count = np.zeros((ncomponents + 1), dtype=np.int)
-                volume = labeled[vbbox[0]:(vbbox[1] + 1), vbbox[2]:(vbbox[3] + 1), vbbox[4]:(vbbox[5] + nvoxel + 1)]
-                self.count_all_labels(volume, ncomponents, count)
-                if self.one_label_present(count, label_number):
+                if self.one_label_present(labeled, [vbbox[0], vbbox[1], vbbox[2], vbbox[3], vbbox[4], vbbox[5] + nvoxel], label_number, ncomponents):
                     vbbox[5] += nvoxel
                 else:
                     growth_xyz[5] = False
-                del count
             else:
                 growth_xyz[5] = False
 
@@ -329,20 +371,17 @@ class Bg_pExpansion(ExpansionStrategy):
         super().__init__(name)
 
     # Must be only background and one label present in the volume.
-    def percentage_calculation(self, count, label_number):
-        bg_p = (count[0] * 100.0) / count.sum()   # background percentage
-        gt_p = (count[label_number] * 100.0) / count.sum()  # groundtruth percentage
+    def percentage_calculation(self, count):
+        # count = (background, label, other labels), see ExpansionStrategy.count_box().
+        bg_p = (count[0] * 100.0) / sum(count)   # background percentage
+        gt_p = (count[1] * 100.0) / sum(count)  # groundtruth percentage
         return bg_p, gt_p
 
     def get_percentage(self, labeled, vbbox, ncomponents, label_number):
-        count = np.zeros((ncomponents + 1), dtype=np.int)
-        volume = labeled[vbbox[0]:vbbox[1] + 1, \
-                         vbbox[2]:vbbox[3] + 1, \
-                         vbbox[4]:vbbox[5] + 1]
-        super().count_all_labels(volume, ncomponents, count)
+        count = super().count_box(labeled, vbbox, label_number, ncomponents)
         #print("    Label : {}".format(label_number))
-        print("      count = {}".format(count))
-        bg_p, gt_p = self.percentage_calculation(count, label_number)
+        print("      count (background, label, other labels) = {}".format(count))
+        bg_p, gt_p = self.percentage_calculation(count)
         print("      Percentage of vbbox: bg_p = {:.2f}, gt_p = {:.2f}".format(round(bg_p, 2), round(gt_p, 2)))
         del count
 
@@ -0,0 +1,98 @@
+import os
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class FeatureCache(object):
+    """
+    Content-addressed cache of the feature tables (DataFrames) extracted for each case, stored as pickle files in
+    cache_path. The key is a hash of everything that changes the table: the image and mask bytes, the radiomics
+    parameters file, the window size, the deltas, the pad mode, the extraction strategy, the window halo and the dtype
+    of the features. When the directory grows larger than max_size bytes, the least recently used tables are removed.
+    Several processes can share the same directory.
+    """
+    def __init__(self, cache_path, max_size, paramPath, tmp_age=3600):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.paramPath = paramPath
+        self.tmp_age = tmp_age      # seconds after which a temporary file is considered left by a crashed writer.
+
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+
+    def key(self, volume, mask, slidingWindow, strategy):
+        h = hashlib.blake2b(digest_size=20)
+
+        for array in (volume, mask):
+            h.update(str((array.shape, array.dtype.str)).encode())
+            h.update(memoryview(np.ascontiguousarray(array)))     # hashed in place, without a copy of the volume.
+
+        with open(self.paramPath, 'rb') as f:
+            h.update(f.read())
+
+        h.update(str((slidingWindow.window_size, tuple(slidingWindow.asteps), slidingWindow.mode)).encode())
+        h.update(str((type(strategy).__name__, strategy.window_halo, strategy.feature_dtype.str)).encode())
+
+        return h.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.cache_path, key + '.pkl')
+
+    def load(self, key):
+        # It returns the cached DataFrame, or None if the key is not in the cache.
+        filename = self.filename(key)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            df = pd.read_pickle(filename)
+        except Exception as e:
+            print("      Warning: the cached features {} could not be read ({}), they are computed again.".format(filename, e))
+            return None
+
+        try:
+            os.utime(filename, None)    # mark it as recently used.
+        except FileNotFoundError:
+            pass    # evicted by another process meanwhile, the table already read is still valid.
+        return df
+
+    def store(self, key, df):
+        filename = self.filename(key)
+
+        # Written to a temporary file and renamed, then a crash never leaves a half-written table in the cache.
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        df.to_pickle(tmp_filename)
+        os.replace(tmp_filename, filename)
+
+        self.evict()
+
+    def evict(self):
+        # Remove the least recently used tables until the cache fits in max_size bytes, and the temporary files left
+        # by crashed writers. Other processes may remove the same files meanwhile.
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_path):
+            path = os.path.join(self.cache_path, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith('.tmp') and now - stat.st_mtime > self.tmp_age:
+                    os.remove(path)
+                    print("      Removed from the feature cache the orphaned file: {}.".format(name))
+                elif name.endswith('.pkl'):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue    # already removed by another process.
+            print("      Removed from the feature cache: {} (last used {}).".format(
+                os.path.basename(path), time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))))
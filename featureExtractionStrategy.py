@@ -3,13 +3,19 @@ import SimpleITK as sitk
 import numpy as np
 import pandas as pd
 import time
+import hashlib
 import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from scipy import ndimage
 
 import os
 from collections import OrderedDict
 import six
 import radiomics
 from radiomics import featureextractor  # This module is used for interaction with pyradiomics
+import vectorizedFeatures
+from timing import Stopwatch, format_times, process_peak_rss, peak_rss, report_worker_usage
+from featureProfile import FeatureClassProfile
 
 
 # def rolling_window(array, window=(0,), asteps=None, wsteps=None, axes=None, toend=True):
@@ -104,16 +110,102 @@ from radiomics import featureextractor  # This module is used for interaction wi
 #
 #     return np.lib.stride_tricks.as_strided(array, shape=new_shape, strides=new_strides)
 
+class WindowMemo(object):
+    """
+    Bounded LRU memo of the features of the windows of one case, keyed by a hash of the bytes of each window. Edge
+    padding and homogeneous regions give many identical windows, then their features are computed only once.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(cube):
+        # The cube is hashed in place once it is contiguous, without another copy of its bytes.
+        return hashlib.blake2b(memoryview(np.ascontiguousarray(cube)), digest_size=16).digest()
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.cache[key] = value
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)  # the least recently used window.
+
+
+def report_memo(hits, misses):
+    total = hits + misses
+    print("         Window memo: {} hits of {} windows ({:.1f}%).".format(hits, total, 100.0 * hits / max(total, 1)))
+
+
 # Abstract class
 class FeatureExtractionStrategy(ABC):
     def __init__(self, name):
         self.name = name
+        self.window_halo = None     # None: all the windows are evaluated (see build_window_selection()).
+        self.memo_size = 0          # 0: the identical windows are not memoized (see build_window_memo()).
+        self.feature_dtype = np.dtype(np.float32)   # dtype of the features in the DataFrame (see build_feature_table()).
+        self.feature_profile = None     # None: the cost of each feature class is not measured (see build_feature_profile()).
         super().__init__()
 
     @abstractmethod
     def featureExtraction(self, array):
         pass
 
+    def build_window_selection(self, window_halo):
+        # None: every window is evaluated. N >= 0: only the windows whose centre is inside the mask dilated N voxels.
+        self.window_halo = window_halo
+
+    def build_window_memo(self, memo_size):
+        # Maximum amount of windows memoized per case, 0 disables the memo.
+        self.memo_size = memo_size
+
+    def build_feature_table(self, feature_dtype):
+        # dtype of the columns of features, 'float32' takes half of the memory than 'float64'.
+        self.feature_dtype = np.dtype(feature_dtype)
+
+    def build_feature_profile(self, enabled):
+        # Measure the time spent in each feature class and report it at the end of each case. It must be called
+        # before build_extractor().
+        self.feature_profile = FeatureClassProfile() if enabled else None
+
+    def windows_to_visit(self, mask, shape, steps=None):
+        """
+        Return the flattened indexes (order='C' over (x, y, z)) of the windows to evaluate, sorted. With a window halo,
+        the background windows farther than window_halo voxels (26-connectivity) from the mask are skipped. steps are
+        the steps of the windows (z, x, y), see SlidingWindow.asteps: the centre of the window k is the voxel
+        k * step of the mask along each axis.
+        """
+        max_x, max_y, max_z = shape
+        if self.window_halo is None:
+            return np.arange(max_x * max_y * max_z)
+
+        inside = mask != 0
+        if self.window_halo > 0:
+            inside = ndimage.binary_dilation(inside, structure=np.ones((3, 3, 3), dtype=bool),
+                                             iterations=self.window_halo)
+
+        dz, dx, dy = (1, 1, 1) if steps is None else steps
+        inside = inside[::dz, ::dx, ::dy][:max_z, :max_x, :max_y]   # the centres of the windows.
+
+        z, x, y = np.nonzero(inside)
+        windows = np.sort(np.ravel_multi_index((x, y, z), (max_x, max_y, max_z)))
+        print("         Evaluating {} of {} windows (halo of {} voxels around the mask).".format(
+            len(windows), max_x * max_y * max_z, self.window_halo))
+        return windows
+
+    def close(self):
+        # Release the resources held by the strategy (e.g. a pool of processes), by default there is nothing to do.
+        pass
+
 
 class RadiomicClass(FeatureExtractionStrategy):
     def __init__(self, name):
@@ -129,13 +221,16 @@ class RadiomicClass(FeatureExtractionStrategy):
     def build_extractor(self, paramPath):
         # Instantiate the extractor with the parameters in the file paramPath.
         self.extractor = featureextractor.RadiomicsFeaturesExtractor(paramPath)
+        if self.feature_profile is not None:
+            self.feature_profile.instrument(self.extractor)
 
         print("Using configuration file to parameters: {}".format(paramPath))
         print("Extraction parameters: {}".format(OrderedDict(sorted(self.extractor.settings.items()))))
         print('Enabled filters:\n\t', OrderedDict(sorted(self.extractor._enabledImagetypes.items())))
         print('Enabled features:\n\t', OrderedDict(sorted(self.extractor._enabledFeatures.items())))
 
-    def featureExtraction(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction):
+    def featureExtraction(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction,
+                          padded_volume=None, slidingWindow=None):
         print("      Using Radiomic to extract features...")
 
         assert type(array).__module__ == np.__name__, "Error, expected a numpy object."
@@ -146,194 +241,633 @@ class RadiomicClass(FeatureExtractionStrategy):
         print("         max_z: {}, max_x: {}, max_y: {}".format(max_z, max_x, max_y))
         print("         Extracting new {} rows of features.".format(max_z * max_x * max_y))
 
-        start_time = time.process_time()
+        stopwatch = Stopwatch()
+
+        steps = None if slidingWindow is None else slidingWindow.asteps
+        windows = self.windows_to_visit(mask, (max_x, max_y, max_z), steps)
+        if len(windows) == 0:
+            print("         Warning: there is not any window to evaluate.")
+            return None
 
-        mydict = []
-        for x in range(max_x):  # x: row
-            for y in range(max_y):  # y: column
-                for z in range(max_z):  # z: deep
+        memo = WindowMemo(self.memo_size) if self.memo_size > 0 else None
+        profile = self.feature_profile
+        if profile is not None:
+            profile.reset()
 
-                    volume = array[z, x, y]     # get a cube from the array.
-                    imageITK = sitk.GetImageFromArray(volume)
+        table = FeatureTable(windows, self.feature_dtype)
+        x, y, z = np.unravel_index(windows, (max_x, max_y, max_z))
+        for n in range(len(windows)):
+            volume = array[z[n], x[n], y[n]]     # get a cube from the array.
 
-                    imageITK.origin = origin
-                    imageITK.spacing = spacing
-                    imageITK.direction = direction
+            new_row = None
+            if memo is not None:
+                key = memo.key(volume)
+                new_row = memo.get(key)
 
-                    new_row = {}
+            if new_row is None:
+                imageITK = sitk.GetImageFromArray(volume)
 
+                imageITK.origin = origin
+                imageITK.spacing = spacing
+                imageITK.direction = direction
+
+                if profile is not None:
+                    featureVector = profile.call(1, self.extractor.execute, imageITK, self.maskITK)
+                else:
                     featureVector = self.extractor.execute(imageITK, self.maskITK)  # allways is used the same mask
-                    # print("Result type: {} and length: {}".format(type(featureVector), len(featureVector)))  # result is returned in a Python ordered dictionary)
-                    # print('')
-                    # print('Calculated features')
-                    for featureName in featureVector.keys():  # Note that featureVectors is a 'disordered dictionary'
-                        # print('Computed %s: %s' % (featureName, featureVector[featureName]))
-                        # print(featureVector[featureName])
-                        if ('firstorder' in featureName) or ('glszm' in featureName) or \
-                            ('glcm' in featureName) or ('glrlm' in featureName) or \
-                            ('gldm' in featureName):
-                            new_row.update({featureName: featureVector[featureName]})
-
-                    lst = sorted(new_row.items()) # Ordering the new_row dictionary
-
-                    # Adding some columns and values at the front of the list
-                    label_value = mask[z, x, y]
-                    lst.insert(0, ('label', label_value))
-                    lst.insert(0, ('axisZ', z))
-                    lst.insert(0, ('axisY', y))
-                    lst.insert(0, ('axisX', x))
-                    # flattened_index = np.ravel_multi_index([[z], [y], [x]], (3, 3, 3), order='F')
-                    #                 np.ravel_multi_index([[2],[1],[0]],rw.shape[:3])
-                    [flattened_index] = np.ravel_multi_index([[x], [y], [z]], (max_x, max_y, max_z))  # order='C'
-                    lst.insert(0, ('flattened_index', int(flattened_index)))
-                    lst.insert(0, ('lessionID', lessionID))
-                    lst.insert(0, ('caseID', caseID))
-                    lst.insert(0, ('mask_filename', mask_filename))
-                    lst.insert(0, ('image_filename', image_filename))
-
-
-                    od = OrderedDict(lst)
-                    # for name in od.keys():
-                    #     print('Computed %s: %s' % (name, od[name]))
-
-
-                    mydict.append(od)
-
-        df = pd.DataFrame.from_dict(mydict)
-
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        print("      Elapsed time for Radiomic to extract features: {:.2f} seconds.".format(elapsed_time))
 
-        return df
+                # The names of the features are the same for all the windows, then they are resolved only once.
+                table.set_names(FeatureTable.select_names(featureVector))
+                new_row = [featureVector[featureName] for featureName in table.featureNames]
 
+                if memo is not None:
+                    memo.put(key, new_row)
 
+            table.put(n, new_row)
 
-############################ PARALLEL COMPUTING ######################################################
+        df = table.to_dataframe((max_x, max_y, max_z), mask, image_filename, mask_filename, caseID, lessionID)
+
+        if memo is not None:
+            report_memo(memo.hits, memo.misses)
+        if profile is not None:
+            profile.report()
 
-results = []
+        print("      Elapsed time for Radiomic to extract features: {}.".format(format_times(stopwatch.stop())))
+
+        return df
 
-def collect_result(result):
-    global results
-    results.append(result)
 
-def do_it(i, x, y, z, flattened_index, winSize, paramPath, volume, label_value, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction):
 
-    #print("Process {} working in index: {}".format(os.getpid(), flattened_index))
+############################ PARALLEL COMPUTING ######################################################
 
-    mask_trick = np.ones((winSize, winSize, winSize), dtype=np.int)
-    maskITK = sitk.GetImageFromArray(mask_trick)
+# Per-process state of the pool's workers. It is built only once per worker by init_worker(), instead of once
+# per window, because parsing the parameters file and building the extractor costs more than the features.
+worker_extractor = None
+worker_maskITK = None
+worker_shared = {}   # shared memory attached by the worker: {name: (SharedMemory, little_cubes)}
+worker_memo_size = 0
+worker_memo = None   # (name of the shared volume, WindowMemo), the memo is restarted for each case.
+worker_featureNames = None   # sorted names of the features, resolved from the first window.
+worker_dtype = np.float32
+worker_profile = None   # FeatureClassProfile of the worker, restarted for each block.
+
+def init_worker(paramPath, winSize, memoSize=0, dtype='float32', profile=False):
+    global worker_extractor, worker_maskITK, worker_memo_size, worker_dtype, worker_profile
+
+    worker_memo_size = memoSize
+    worker_dtype = np.dtype(dtype)
+
+    # build a 3D mask with all in 1's, then it is converted to SimpleITK.
+    mask_trick = np.ones((winSize, winSize, winSize), dtype=np.int64)
+    worker_maskITK = sitk.GetImageFromArray(mask_trick)
+
+    # Instantiate the extractor with the parameters in the file paramPath.
+    worker_extractor = featureextractor.RadiomicsFeaturesExtractor(paramPath)
+    if profile:
+        worker_profile = FeatureClassProfile()
+        worker_profile.instrument(worker_extractor)
+
+def share_volume(volume):
+    """
+    Copy the (padded) volume once into a new block of shared memory. It returns the SharedMemory object, which must be
+    closed and unlinked by the caller, and a small descriptor (name, shape, dtype) to be sent to the workers.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(volume.nbytes, 1))
+    shared = np.ndarray(volume.shape, dtype=volume.dtype, buffer=shm.buf)
+    shared[...] = volume
+    del shared
+
+    return shm, (shm.name, volume.shape, volume.dtype.str)
+
+def open_shared(name):
+    """
+    Attach to a block of shared memory created by share_volume() without registering it with the resource tracker of
+    the worker: the block belongs to the parent, which unlinks it. A worker's registration would be reported as a leak
+    (and unlinked again) when the worker's tracker ends, or, with the tracker of the parent, it could not be removed
+    from the worker without removing the parent's one.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)     # Python >= 3.13
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def attach_volume(descriptor, slidingWindow):
+    """
+    Used by the workers to get the little cubes of the volume placed in shared memory by share_volume(). The rolling
+    window view is built only once per case, and the blocks of previous cases are released.
+    """
+    global worker_shared
+    name, shape, dtype = descriptor
+
+    if name not in worker_shared:
+        for old_name in list(worker_shared.keys()):
+            old_shm, old_cubes = worker_shared.pop(old_name)
+            del old_cubes   # the view must be released before closing its block of memory.
+            old_shm.close()
+
+        shm = open_shared(name)
+        volume = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        worker_shared[name] = (shm, slidingWindow.rolling_window(volume))
+
+    return worker_shared[name][1]
+
+def do_it(index, shape, descriptor, slidingWindow, origin, spacing, direction):
+    """
+    Extract the features of a block of windows. Only the flattened indexes of the windows are received, the cubes are
+    read from the volume in shared memory (see share_volume()). It returns a compact numeric block: the flattened
+    indexes of the windows, a matrix with one row of features per window, the (sorted) names of the features, the
+    hits and misses of the worker's window memo for this block, the cost of each feature class in this block
+    ((seconds by class, windows), or None if the classes are not profiled) and the usage of the worker (pid, CPU
+    seconds of this block, peak RSS), see timing.report_worker_usage().
+    """
+    global worker_memo, worker_featureNames
+    cpu = time.process_time()
+    #print("Process {} working in the indexes: {}..{}".format(os.getpid(), index[0], index[-1]))
+
+    little_cubes = attach_volume(descriptor, slidingWindow)
+
+    memo = None
+    if worker_memo_size > 0:
+        if worker_memo is None or worker_memo[0] != descriptor[0]:
+            worker_memo = (descriptor[0], WindowMemo(worker_memo_size))
+        memo = worker_memo[1]
+        hits, misses = memo.hits, memo.misses
+    if worker_profile is not None:
+        worker_profile.reset()
+    x, y, z = np.unravel_index(index, shape)
+
+    maskITK = worker_maskITK
     maskITK.origin = origin
     maskITK.spacing = spacing
     maskITK.direction = direction
 
-    extractor = featureextractor.RadiomicsFeaturesExtractor(paramPath)
-
-    imageITK = sitk.GetImageFromArray(volume)
-    imageITK.origin = origin
-    imageITK.spacing = spacing
-    imageITK.direction = direction
-
-    new_row = {}
-
-    featureVector = extractor.execute(imageITK, maskITK)  # allways is used the same mask
-    # print("Result type: {} and length: {}".format(type(featureVector), len(featureVector)))  # result is returned in a Python ordered dictionary)
-    # print('')
-    # print('Calculated features')
-    for featureName in featureVector.keys():  # Note that featureVectors is a 'disordered dictionary'
-        # print('Computed %s: %s' % (featureName, featureVector[featureName]))
-        # print(featureVector[featureName])
-        if ('firstorder' in featureName) or ('glszm' in featureName) or \
-                ('glcm' in featureName) or ('glrlm' in featureName) or \
-                ('gldm' in featureName):
-            new_row.update({featureName: featureVector[featureName]})
-
-    lst = sorted(new_row.items())  # Ordering the new_row dictionary
-
-    # Adding some columns and values at the front of the list
-    # label_value = mask[z, x, y]
-    lst.insert(0, ('label', label_value))
-    lst.insert(0, ('axisZ', z))
-    lst.insert(0, ('axisY', y))
-    lst.insert(0, ('axisX', x))
-    # flattened_index = np.ravel_multi_index([[z], [y], [x]], (3, 3, 3), order='F')
-    #                 np.ravel_multi_index([[2],[1],[0]],rw.shape[:3])
-    # [flattened_index] = np.ravel_multi_index([[x], [y], [z]], (max_x, max_y, max_z))  # order='C'
-    lst.insert(0, ('flattened_index', int(flattened_index)))
-    lst.insert(0, ('lessionID', lessionID))
-    lst.insert(0, ('caseID', caseID))
-    lst.insert(0, ('mask_filename', mask_filename))
-    lst.insert(0, ('image_filename', image_filename))
-
-    od = OrderedDict(lst)
-    # for name in od.keys():
-    #     print('Computed %s: %s' % (name, od[name]))
-
-    #print("Process {} done processing index: {}".format(os.getpid(), flattened_index))
-
-    return (i, od)
+    features = None
+
+    for n in range(len(index)):
+        volume = little_cubes[z[n], x[n], y[n]]     # get a cube from the array.
+
+        lst = None
+        if memo is not None:
+            key = memo.key(volume)
+            lst = memo.get(key)
+
+        if lst is None:
+            imageITK = sitk.GetImageFromArray(volume)
+            imageITK.origin = origin
+            imageITK.spacing = spacing
+            imageITK.direction = direction
+
+            if worker_profile is not None:
+                featureVector = worker_profile.call(1, worker_extractor.execute, imageITK, maskITK)
+            else:
+                featureVector = worker_extractor.execute(imageITK, maskITK)  # allways is used the same mask
+
+            # The names of the features are the same for all the windows, then they are resolved only once.
+            if worker_featureNames is None:
+                worker_featureNames = FeatureTable.select_names(featureVector)
+            lst = [featureVector[featureName] for featureName in worker_featureNames]
+
+            if memo is not None:
+                memo.put(key, lst)
+
+        if features is None:
+            features = np.empty((len(index), len(worker_featureNames)), dtype=worker_dtype)
+        features[n] = lst
+
+    #print("Process {} done processing the indexes: {}..{}".format(os.getpid(), index[0], index[-1]))
+
+    profile = None
+    if worker_profile is not None:
+        profile = (worker_profile.seconds, worker_profile.windows)
+
+    usage = (os.getpid(), time.process_time() - cpu, process_peak_rss() or peak_rss())
+
+    if memo is None:
+        return (index, features, worker_featureNames, 0, 0, profile, usage)
+    return (index, features, worker_featureNames, memo.hits - hits, memo.misses - misses, profile, usage)
+
+
+def categorical_column(value, nrows):
+    # A column with the same string in all the rows, stored as a category instead of nrows Python objects.
+    return pd.Categorical.from_codes(np.zeros(nrows, dtype=np.int8), categories=[value])
+
+
+def features_to_dataframe(index, features, featureNames, shape, mask, image_filename, mask_filename, caseID, lessionID):
+    """
+    Build the DataFrame of features with the same columns than RadiomicClass: first the information of each window
+    (image_filename, mask_filename, caseID, lessionID, flattened_index, axisX, axisY, axisZ, label), then the features.
+
+    index is the vector of flattened indexes (order='C' over shape, with shape = (max_x, max_y, max_z)) and features
+    is a matrix with a row per index and a column per name in featureNames. The matrix is used as the block of the
+    features without copying it, and the filenames are categorical columns.
+    """
+    x, y, z = np.unravel_index(index, shape)
+
+    df = pd.DataFrame(features, columns=featureNames, copy=False)
+
+    columns = OrderedDict()
+    columns['image_filename'] = categorical_column(image_filename, len(index))
+    columns['mask_filename'] = categorical_column(mask_filename, len(index))
+    columns['caseID'] = np.full(len(index), caseID)
+    columns['lessionID'] = np.full(len(index), lessionID)
+    columns['flattened_index'] = index
+    columns['axisX'] = x
+    columns['axisY'] = y
+    columns['axisZ'] = z
+    columns['label'] = mask[z, x, y]
+
+    for loc, (name, values) in enumerate(columns.items()):
+        df.insert(loc, name, values)
+
+    return df
+
+
+class FeatureTable(object):
+    """
+    Columnar builder of the features of a case: a matrix preallocated with a row per evaluated window and a column per
+    feature, instead of a dictionary per window. The names of the features (sorted, only the feature classes) are
+    resolved once from the first result, and the next results are placed by position.
+    """
+    FEATURE_CLASSES = ('firstorder', 'glszm', 'glcm', 'glrlm', 'gldm')
+
+    def __init__(self, windows, dtype=np.float32):
+        self.windows = windows      # sorted flattened indexes of the evaluated windows.
+        self.dtype = np.dtype(dtype)
+        self.featureNames = None
+        self.features = None
+
+    @classmethod
+    def select_names(cls, featureVector):
+        # The names of the features returned by pyradiomics, without the diagnostics and sorted.
+        return sorted(name for name in featureVector.keys() if any(c in name for c in cls.FEATURE_CLASSES))
+
+    def set_names(self, featureNames):
+        if self.featureNames is None:
+            self.featureNames = list(featureNames)
+            self.features = np.empty((len(self.windows), len(self.featureNames)), dtype=self.dtype)
+
+    def put(self, start, values):
+        # values: a row or a matrix of contiguous rows, from the position start in windows.
+        values = np.asarray(values)
+        self.features[start:start + (len(values) if values.ndim == 2 else 1)] = values
+
+    def put_index(self, index, values):
+        # values: a matrix with a row per flattened index in index.
+        self.features[np.searchsorted(self.windows, index)] = values
+
+    def to_dataframe(self, shape, mask, image_filename, mask_filename, caseID, lessionID):
+        return features_to_dataframe(self.windows, self.features, self.featureNames, shape, mask,
+                                     image_filename, mask_filename, caseID, lessionID)
 
 
 class RadiomicParallelClass(FeatureExtractionStrategy):
-    def __init__(self, name, ncores):
+    def __init__(self, name, ncores, chunk_size=1, checkpoint_path=None, checkpoint_interval=300):
         self.radiomicNCores = ncores
+        self.chunk_size = chunk_size    # amount of windows sent to the pool in each task.
+        self.window_size = None
+        self.paramPath = None
+        self.pool = None    # long-lived pool, it is reused across all the cases.
+        self.pool_initargs = None   # arguments of init_worker() of the workers of the pool.
+        self.checkpoint_path = checkpoint_path  # folder of the partial results of each case, None disables them.
+        self.checkpoint_interval = checkpoint_interval  # seconds between two checkpoints of the same case.
         super().__init__(name)
 
     def build_mask_trick(self, window_size):
-        print("Empty dummy function.")
+        # The mask is built only once inside each worker, see init_worker().
+        self.window_size = window_size
 
     def build_extractor(self, paramPath):
-        print("Empty dummy function.")
-
+        # The extractor is built only once inside each worker, see init_worker().
+        self.paramPath = paramPath
+        print("Using configuration file to parameters: {}".format(paramPath))
 
-    def featureExtraction(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction):
+    def get_pool(self):
+        initargs = (self.paramPath, self.window_size, self.memo_size, self.feature_dtype.str,
+                    self.feature_profile is not None)
+        if self.pool is not None and self.pool_initargs != initargs:
+            # The workers keep what init_worker() received (e.g. the size of their window memo), then the pool is
+            # started again when the settings change.
+            print("      The settings of the workers have changed, the pool is restarted.")
+            self.close()
+
+        if self.pool is None:
+            assert self.window_size is not None, "Error, build_mask_trick() must be called before using the pool."
+            assert self.paramPath is not None, "Error, build_extractor() must be called before using the pool."
+            # The workers are not forked from this process, which may have other threads running (e.g. the prefetch
+            # of the next cases, see NiftiManagementPlugin) whose locks would be copied held into the children. The
+            # workers are children of the forkserver, then they report their own CPU and peak RSS with each block.
+            method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+            self.pool = mp.get_context(method).Pool(self.radiomicNCores, initializer=init_worker, initargs=initargs)
+            self.pool_initargs = initargs
+            print("      Pool started with {} workers.".format(self.radiomicNCores))
+        return self.pool
+
+    def checkpoint_filename(self, image_filename, lessionID, padded_volume, windows):
+        # The partial file is only valid for the same volume, windows, blocks and parameters.
+        h = hashlib.blake2b(digest_size=8)
+        h.update(memoryview(np.ascontiguousarray(padded_volume)))   # hashed in place, without a copy of its bytes.
+        h.update(memoryview(np.ascontiguousarray(windows)))
+        h.update(str((self.chunk_size, self.window_size)).encode())
+        with open(self.paramPath, 'rb') as f:
+            h.update(f.read())
+
+        name = '{}_{}.{}.partial.npz'.format(image_filename.split('.')[0], lessionID, h.hexdigest())
+        return os.path.join(self.checkpoint_path, name)
+
+    def save_checkpoint(self, filename, done):
+        # The completed blocks are written to a temporary file and renamed, then the partial file is never left broken.
+        if len(done) == 0:
+            return
+
+        tmp_filename = '{}.{}.tmp.npz'.format(filename, os.getpid())
+        np.savez(tmp_filename, index=np.concatenate([r[0] for r in done]),
+                 features=np.concatenate([r[1] for r in done]), featureNames=np.array(done[0][2]))
+        os.replace(tmp_filename, filename)
+        print("         Checkpoint of {} windows saved to: {}".format(sum(len(r[0]) for r in done), filename))
+
+    def load_checkpoint(self, filename):
+        # It returns the completed blocks as a single result, or an empty list if there is not any partial file.
+        if not os.path.isfile(filename):
+            return []
+
+        with np.load(filename) as partial:
+            done = [(partial['index'], partial['features'], [str(name) for name in partial['featureNames']], 0, 0, None,
+                     None)]
+        print("         Resuming from the checkpoint {} with {} windows done.".format(filename, len(done[0][0])))
+        return done
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            print("      Pool closed.")
+
+
+    def featureExtraction(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction,
+                          padded_volume=None, slidingWindow=None):
         print("      Using Parallel Radiomic to extract features...")
 
         assert type(array).__module__ == np.__name__, "Error, expected a numpy object."
         assert array.ndim == 6, "Error, the array's dimension must be equal to 6."
+        assert padded_volume is not None and slidingWindow is not None, "Error, the padded volume and the sliding window are needed to share the volume with the workers."
 
         max_z, max_x, max_y = array.shape[:3]
 
         print("         max_z: {}, max_x: {}, max_y: {}".format(max_z, max_x, max_y))
         print("         Extracting new {} rows of features.".format(max_z * max_x * max_y))
 
-        start_time = time.process_time()
+        stopwatch = Stopwatch()
+
+        steps = None if slidingWindow is None else slidingWindow.asteps
+        windows = self.windows_to_visit(mask, (max_x, max_y, max_z), steps)
+        if len(windows) == 0:
+            print("         Warning: there is not any window to evaluate.")
+            return None
+
+        # The blocks already done by a previous (interrupted) run of this case are not computed again.
+        checkpoint = None
+        restored = []
+        done = set()
+        if self.checkpoint_path is not None:
+            if not os.path.exists(self.checkpoint_path):
+                os.makedirs(self.checkpoint_path)
+            checkpoint = self.checkpoint_filename(image_filename, lessionID, padded_volume, windows)
+            restored = self.load_checkpoint(checkpoint)
+            if restored:
+                done = set(restored[0][0].tolist())
+
+        # The padded volume is placed once in shared memory, then only the windows' indexes are sent to the workers.
+        shm, descriptor = share_volume(padded_volume)
+
+        pool = self.get_pool()    # the same pool is used for all the cases.
+        pending = []
+
+        # Each task covers a contiguous block of windows, following the order of the flattened index (order='C').
+        for start in range(0, len(windows), self.chunk_size):
+            index = windows[start:start + self.chunk_size]
+            if index[0] in done:
+                continue
+
+            pending.append(pool.apply_async(do_it, args=(index, (max_x, max_y, max_z), descriptor, slidingWindow,
+                                                         origin, spacing, direction)))
+
+        print("         Submitted {} tasks of up to {} windows.".format(len(pending), self.chunk_size))
+
+        # Waiting for all the tasks of this case, the pool is kept alive for the next one. The results are taken from
+        # the tasks of this case only, then a task left behind by a failed case never reaches the next one.
+        results = list(restored)
+        last_checkpoint = time.time()
+        try:
+            for n, task in enumerate(pending):
+                results.append(task.get())
+                report_worker_usage(*results[-1][6])
+                if checkpoint is not None and time.time() - last_checkpoint > self.checkpoint_interval:
+                    ready = [t.get() for t in pending[n + 1:] if t.ready()]
+                    self.save_checkpoint(checkpoint, results + ready)
+                    last_checkpoint = time.time()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        # The blocks arrive in any order (and the restored ones are not contiguous), then each one is placed in the
+        # table by the position of its flattened indexes.
+        table = FeatureTable(windows, self.feature_dtype)
+        table.set_names(results[0][2])
+        for r in results:
+            table.put_index(r[0], r[1])
+        if self.memo_size > 0:
+            report_memo(sum(r[3] for r in results), sum(r[4] for r in results))
+        if self.feature_profile is not None:
+            self.feature_profile.reset()
+            for r in results:
+                if r[5] is not None:
+                    self.feature_profile.merge(*r[5])
+            self.feature_profile.report()
+
+        df = table.to_dataframe((max_x, max_y, max_z), mask, image_filename, mask_filename, caseID, lessionID)
+
+        if checkpoint is not None and os.path.isfile(checkpoint):
+            os.remove(checkpoint)   # the case is complete, its partial results are not needed anymore.
+
+        print("      Elapsed time for Radiomic to extract features: {}.".format(format_times(stopwatch.stop())))
 
-        global results
-        results = []
+        return df
 
-        # TODO: add parameter
-        pool = mp.Pool(self.radiomicNCores)    # pool = mp.Pool(mp.cpu_count()-1)
+############################ PARALLEL COMPUTING ######################################################
 
-        for x in range(max_x):  # x: row
-            for y in range(max_y):  # y: column
-                for z in range(max_z):  # z: deep
 
-                    volume = array[z, x, y]     # get a cube from the array.
-                    label_value = mask[z, x, y]
-                    [flattened_index] = np.ravel_multi_index([[x], [y], [z]], (max_x, max_y, max_z))  # order='C'
 
-                    winSize=3
-                    paramPath = "/home/willytell/Documentos/PhD/lc3d/config/Params.yaml"
-                    i = flattened_index # used to get back an ordered list.
+class VectorizedRadiomicClass(FeatureExtractionStrategy):
+    """
+    Compute the radiomic features for blocks of windows at once, with batched NumPy reductions over the rolling window
+    view (see vectorizedFeatures), instead of calling pyradiomics one cube at a time. The columns of the DataFrame are
+    the same than the ones of RadiomicClass.
+    """
+    def __init__(self, name, chunk_size=4096, global_discretization=True, sliding_firstorder=True, sliding_glcm=True):
+        self.chunk_size = chunk_size    # amount of windows processed at once.
+        self.global_discretization = global_discretization  # discretize the whole volume once instead of each window.
+        self.sliding_firstorder = sliding_firstorder  # update the first order features window by window when possible.
+        self.sliding_glcm = sliding_glcm  # update the co-occurrence counts window by window when possible.
+        self.window_size = None
+        self.settings = None
+        self.enabledFeatures = None
+        super().__init__(name)
 
-                    pool.apply_async(do_it, args=(i, x, y, z, flattened_index, winSize, paramPath, volume, label_value,
-                                    image_filename, mask_filename, caseID, lessionID, origin, spacing, direction), callback=collect_result)
+    def build_mask_trick(self, window_size):
+        # All the voxels of the window are used, then the mask is not needed.
+        self.window_size = window_size
 
-        pool.close()
-        pool.join()
+    def build_extractor(self, paramPath):
+        # The extractor of pyradiomics is only used to read the parameters file, with the same default values.
+        extractor = featureextractor.RadiomicsFeaturesExtractor(paramPath)
 
-        results.sort(key=lambda x: x[0])
-        results_final = [r for i, r in results]
+        print("Using configuration file to parameters: {}".format(paramPath))
+        print("Extraction parameters: {}".format(OrderedDict(sorted(extractor.settings.items()))))
+        print('Enabled filters:\n\t', OrderedDict(sorted(extractor._enabledImagetypes.items())))
+        print('Enabled features:\n\t', OrderedDict(sorted(extractor._enabledFeatures.items())))
+
+        assert list(extractor._enabledImagetypes.keys()) == ['Original'], "Error, only the 'Original' image type is supported."
+        assert extractor.settings.get('distances', [1]) == [1], "Error, only the distance 1 is supported."
+
+        self.settings = extractor.settings
+        self.enabledFeatures = OrderedDict()
+        for featureClass, enabled in sorted(extractor._enabledFeatures.items()):
+            if featureClass in vectorizedFeatures.FEATURE_CLASSES:
+                self.enabledFeatures[featureClass] = enabled
+            else:
+                print("Warning: the feature class '{}' is not supported by {}, it is skipped.".format(featureClass, self.name))
+
+    def sliding_features(self, padded_volume, levelVolume):
+        """
+        Compute the features that are updated window by window along the lines of windows (see
+        vectorizedFeatures.sliding_firstorder_features() and vectorizedFeatures.sliding_glcm_features()).
+
+        Returns
+        -------
+        enabledFeatures : the features that are still computed by block.
+        slidingFeatures : dict {'original_<featureClass>_<featureName>': array of shape (Z, X, Y)}.
+        """
+        enabledFeatures = OrderedDict(self.enabledFeatures)
+        slidingFeatures = {}
+        profile = self.feature_profile if self.feature_profile is not None else FeatureClassProfile()
+
+        if self.sliding_firstorder and 'firstorder' in enabledFeatures:
+            names = vectorizedFeatures.enabled_feature_names('firstorder', enabledFeatures['firstorder'])
+            sliding = [name for name in names if name in vectorizedFeatures.SLIDING_FIRSTORDER]
+            with profile.measure('original_firstorder'):
+                values = vectorizedFeatures.sliding_firstorder_features(
+                    padded_volume, levelVolume, self.window_size, sliding,
+                    voxelArrayShift=self.settings.get('voxelArrayShift', 0))
+            for name, value in values.items():
+                slidingFeatures['original_firstorder_{}'.format(name)] = value
+
+            remaining = [name for name in names if name not in sliding]
+            if remaining:
+                enabledFeatures['firstorder'] = remaining
+            else:
+                del enabledFeatures['firstorder']
+            print("         First order features updated sliding the windows: {}.".format(sliding))
+
+        grayLevels = int(levelVolume.max()) + 1
+        if self.sliding_glcm and 'glcm' in enabledFeatures and grayLevels > vectorizedFeatures.SLIDING_GLCM_MAX_LEVELS:
+            print("         GLCM features computed by block: {} gray levels, more than {} for the sliding counts.".format(
+                grayLevels, vectorizedFeatures.SLIDING_GLCM_MAX_LEVELS))
+        elif self.sliding_glcm and 'glcm' in enabledFeatures and self.settings.get('weightingNorm') is None:
+            names = vectorizedFeatures.enabled_feature_names('glcm', enabledFeatures['glcm'])
+            with profile.measure('original_glcm'):
+                values = vectorizedFeatures.sliding_glcm_features(
+                    levelVolume, self.window_size, names, self.settings.get('symmetricalGLCM', True))
+            for name, value in values.items():
+                slidingFeatures['original_glcm_{}'.format(name)] = value
+
+            del enabledFeatures['glcm']
+            print("         GLCM features updated sliding the windows.")
+
+        return enabledFeatures, slidingFeatures
+
+    def featureExtraction(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction,
+                          padded_volume=None, slidingWindow=None):
+        print("      Using Vectorized Radiomic to extract features...")
 
-        df = pd.DataFrame.from_dict(results_final)
+        assert type(array).__module__ == np.__name__, "Error, expected a numpy object."
+        assert array.ndim == 6, "Error, the array's dimension must be equal to 6."
 
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        print("      Elapsed time for Radiomic to extract features: {:.2f} seconds.".format(elapsed_time))
+        max_z, max_x, max_y = array.shape[:3]
 
-        return df
+        print("         max_z: {}, max_x: {}, max_y: {}".format(max_z, max_x, max_y))
+        print("         Extracting new {} rows of features.".format(max_z * max_x * max_y))
 
-############################ PARALLEL COMPUTING ######################################################
+        stopwatch = Stopwatch()
+
+        nwindows = max_x * max_y * max_z
+
+        steps = None if slidingWindow is None else slidingWindow.asteps
+        windows = self.windows_to_visit(mask, (max_x, max_y, max_z), steps)
+        if len(windows) == 0:
+            print("         Warning: there is not any window to evaluate.")
+            return None
+
+        binCount = self.settings.get('binCount')
+        wholeVolume = padded_volume is not None and slidingWindow is not None
+        useVolume = self.global_discretization or self.sliding_firstorder or self.sliding_glcm
+        if wholeVolume and binCount is not None and useVolume:
+            print("         Warning: binCount depends on the range of each window, it is discretized by window.")
+
+        # Without profiling the classes, the times are measured in a profile that is not reported.
+        profile = self.feature_profile if self.feature_profile is not None else FeatureClassProfile()
+        profile.reset()
+
+        levelVolume = None
+        if wholeVolume and binCount is None and useVolume:
+            with profile.measure('other'):
+                levelVolume = vectorizedFeatures.discretize_volume(padded_volume, self.settings.get('binWidth', 25))
+
+        levelArray = None
+        if levelVolume is not None and self.global_discretization:
+            levelArray = slidingWindow.rolling_window(levelVolume)
+            print("         Gray levels discretized once for the whole volume ({}).".format(levelVolume.dtype))
+
+        # With steps of 1, some features are updated from the previous window instead of computed by block. They are
+        # computed for the whole volume, so it is only worth when most of the windows are evaluated.
+        enabledFeatures = self.enabledFeatures
+        slidingFeatures = {}
+        if levelVolume is not None and tuple(slidingWindow.asteps) == (1, 1, 1) and 2 * len(windows) > nwindows:
+            enabledFeatures, slidingFeatures = self.sliding_features(padded_volume, levelVolume)
 
+        table = FeatureTable(windows, self.feature_dtype)
+
+        # The windows are processed in blocks following the order of the flattened index (order='C').
+        for start in range(0, len(windows), self.chunk_size):
+            index = windows[start:start + self.chunk_size]
+            x, y, z = np.unravel_index(index, (max_x, max_y, max_z))
+
+            cubes = array[z, x, y]    # get the block of cubes from the array.
+            levels = None
+            if levelArray is not None:
+                levels = vectorizedFeatures.rebase_levels(levelArray[z, x, y])
+            block = profile.call(len(index), vectorizedFeatures.extract, cubes, enabledFeatures, self.settings, levels,
+                                 profile)
+            for featureName, value in slidingFeatures.items():
+                block[featureName] = value[z, x, y]
+
+            table.set_names(sorted(block.keys()))
+            for j, featureName in enumerate(table.featureNames):
+                table.features[start:start + len(index), j] = block[featureName]
+
+        df = table.to_dataframe((max_x, max_y, max_z), mask, image_filename, mask_filename, caseID, lessionID)
+
+        if self.feature_profile is not None:
+            self.feature_profile.report()
+
+        print("      Elapsed time for Vectorized Radiomic to extract features: {}.".format(format_times(stopwatch.stop())))
+
+        return df
 
 
 def debug_test():
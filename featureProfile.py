@@ -0,0 +1,112 @@
+import time
+from contextlib import contextmanager
+import radiomics
+from radiomics import featureextractor
+
+
+@contextmanager
+def feature_classes(classes):
+    # Make featureextractor of pyradiomics >= 3 use the given feature classes while the block runs.
+    getFeatureClasses = featureextractor.getFeatureClasses
+    featureextractor.getFeatureClasses = lambda: classes
+    try:
+        yield
+    finally:
+        featureextractor.getFeatureClasses = getFeatureClasses
+
+
+class FeatureClassProfile(object):
+    """
+    Time spent in each feature class and image type ('<imageType>_<featureClass>', e.g. 'original_glcm'), summed over
+    all the windows of a case and over all the workers. The rest of the extraction (building the images, filters,
+    discretization, ...) is accumulated as 'other'. It is used to decide which classes are worth keeping in the
+    parameters file.
+    """
+    def __init__(self):
+        self.imageType = 'original'     # image type being computed by the extractor, see instrument().
+        self.seconds = {}
+        self.windows = 0
+
+    def reset(self):
+        self.seconds = {}
+        self.windows = 0
+
+    def add(self, key, seconds):
+        self.seconds[key] = self.seconds.get(key, 0.0) + seconds
+
+    def merge(self, seconds, windows):
+        # Add the times measured by another profile (e.g. the one of a worker of the pool).
+        for key, value in seconds.items():
+            self.add(key, value)
+        self.windows += windows
+
+    @contextmanager
+    def measure(self, key):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, time.perf_counter() - start_time)
+
+    def call(self, nwindows, function, *args):
+        # Call function (which computes the features of nwindows windows), the time not measured by the feature
+        # classes inside it is accumulated as 'other'.
+        measured = sum(self.seconds.values())
+        start_time = time.perf_counter()
+        result = function(*args)
+        elapsed_time = time.perf_counter() - start_time
+        self.add('other', max(elapsed_time - (sum(self.seconds.values()) - measured), 0.0))
+        self.windows += nwindows
+        return result
+
+    def timed_class(self, featureClassName, featureClass):
+        # Subclass of a feature class of pyradiomics that measures its matrices (__init__) and its features (execute).
+        profile = self
+
+        class TimedFeatureClass(featureClass):
+            def __init__(self, *args, **kwargs):
+                with profile.measure('{}_{}'.format(profile.imageType, featureClassName)):
+                    super().__init__(*args, **kwargs)
+
+            def execute(self):
+                with profile.measure('{}_{}'.format(profile.imageType, featureClassName)):
+                    return super().execute()
+
+        TimedFeatureClass.__name__ = featureClass.__name__
+        return TimedFeatureClass
+
+    def instrument(self, extractor):
+        # Make the extractor of pyradiomics measure each feature class, for each image type, in this profile.
+        computeFeatures = extractor.computeFeatures
+
+        def timedComputeFeatures(image, mask, imageTypeName, **kwargs):
+            self.imageType = imageTypeName
+            return computeFeatures(image, mask, imageTypeName, **kwargs)
+
+        extractor.computeFeatures = timedComputeFeatures
+
+        if hasattr(extractor, 'featureClasses'):
+            extractor.featureClasses = {name: self.timed_class(name, featureClass)
+                                        for name, featureClass in extractor.featureClasses.items()}
+        else:
+            # pyradiomics >= 3 reads the feature classes from the module on each call: the timed ones are swapped in
+            # only during the calls of this extractor, the other extractors of the process keep the original ones.
+            timedClasses = {name: self.timed_class(name, featureClass)
+                            for name, featureClass in radiomics.getFeatureClasses().items()}
+
+            def timed(method):
+                def timedMethod(*args, **kwargs):
+                    with feature_classes(timedClasses):
+                        return method(*args, **kwargs)
+                return timedMethod
+
+            extractor.computeFeatures = timed(extractor.computeFeatures)
+            extractor.computeShape = timed(extractor.computeShape)
+
+    def report(self):
+        total = sum(self.seconds.values())
+        print("      Cost by feature class ({} windows, {:.2f} seconds summed over the workers):".format(self.windows,
+                                                                                                      total))
+        for key, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            print("         {:<24} {:10.2f} s {:6.1f} % {:12.1f} windows/s".format(
+                key, seconds, 100.0 * seconds / max(total, 1e-12), self.windows / max(seconds, 1e-12)))
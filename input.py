@@ -2,6 +2,7 @@
 
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from plugin import Plugin
 from imageFormat import NiftiFormat
@@ -15,7 +16,7 @@ from configuration import Configuration
 #         super().__init__(name)
 
 class NiftiManagementPlugin(Plugin):
-    def __init__(self, name, input_key, src_image_path, src_mask_path, mask_pattern, dst_image_path, dst_mask_path, internal=1):     #mask_pattern = '*.nii.gz'
+    def __init__(self, name, input_key, src_image_path, src_mask_path, mask_pattern, dst_image_path, dst_mask_path, internal=1, prefetch=0):     #mask_pattern = '*.nii.gz'
         self.src_image_path = src_image_path
         self.src_mask_path = src_mask_path
         self.mask_pattern = mask_pattern
@@ -30,6 +31,11 @@ class NiftiManagementPlugin(Plugin):
         self.image_filename = ''
         self.caseID = -1        # -1 means Not assigned yet
         self.lessionID = -1     # -1 means Not assigned yet
+        # amount of next cases read in background while the current one is processed. It only helps when the plugin
+        # goes through its whole list of cases (a sequential run), the work queue and the case runner give it one case.
+        self.prefetch = prefetch
+        self.prefetched = {}        # {mask_filename: future of (image, mask)}
+        self.executor = None
         super().__init__(name, input_key)
 
     def masks2read(self):
@@ -70,6 +76,44 @@ class NiftiManagementPlugin(Plugin):
             return None
 
 
+    def read_case(self, mask_filename):
+        # Read the mask and its image, and convert them to numpy arrays (the image is normalized).
+        mask = NiftiFormat()
+        mask.read(self.src_mask_path, mask_filename)
+        mask.image2array(normalize_flag=False)
+
+        image = NiftiFormat()
+        image_filename = self.get_image_filename(mask_filename)
+        image.read(self.src_image_path, image_filename)
+        image.caseID = mask.caseID = self.caseID
+        image.lessionID = mask.lessionID = self.lessionID
+        image.image2array(normalize_flag=True)
+
+        return image, mask
+
+    def fill_prefetch(self):
+        # Submit the reading of the current case and the next self.prefetch ones to a background thread, then the
+        # decompression of the next cases overlaps with the processing of the current one.
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        upcoming = self.src_mask_list[self.index:self.index + self.prefetch + 1]
+        for mask_filename in list(self.prefetched.keys()):
+            if mask_filename not in upcoming:
+                self.prefetched.pop(mask_filename).cancel()
+
+        for mask_filename in upcoming:
+            if mask_filename not in self.prefetched:
+                self.prefetched[mask_filename] = self.executor.submit(self.read_case, mask_filename)
+
+    def close(self):
+        if self.executor is not None:
+            for future in self.prefetched.values():
+                future.cancel()
+            self.prefetched = {}
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
     # def images2read(self):
     #     self.src_image_list = []
     #
@@ -92,22 +136,14 @@ class NiftiManagementPlugin(Plugin):
             print("    Removing from data: '{}':[image, mask]".format(self.name))
 
         if self.index < len(self.src_mask_list):
-            # read the mask file
-            self.mask = NiftiFormat()
             self.mask_filename = self.src_mask_list[self.index]
-            self.mask.read(self.src_mask_path, self.mask_filename)
-            self.mask.caseID = self.caseID
-            self.mask.lessionID = self.lessionID
-            self.mask.image2array(normalize_flag=False)
+            if self.prefetch > 0:
+                self.fill_prefetch()
+                self.image, self.mask = self.prefetched.pop(self.mask_filename).result()
+            else:
+                self.image, self.mask = self.read_case(self.mask_filename)
+            self.image_filename = self.image.filename
             print("    Mask shape:  {}".format(self.mask.volume.shape))
-
-            # read the image file
-            self.image = NiftiFormat()
-            self.image_filename = self.get_image_filename(self.mask_filename)
-            self.image.read(self.src_image_path, self.image_filename)
-            self.image.caseID = self.caseID
-            self.image.lessionID = self.lessionID
-            self.image.image2array(normalize_flag=True)
             print("    Image shape: {}".format(self.image.volume.shape))
 
             assert self.image.volume.shape == self.mask.volume.shape, "    In NiftiManagement, it is supposed that image's volume and mask's volume should have the same shape."
@@ -1,8 +1,9 @@
 import time
 from input import NiftiManagementPlugin
 from utils import get_components
-from plugin import LabelPlugin, VolumeBBoxPlugin, ExpandVBBoxPlugin, SaveVBBoxNiftiPlugin
+from plugin import LabelPlugin, VolumeBBoxPlugin, ComponentStatsPlugin, ExpandVBBoxPlugin, SaveVBBoxNiftiPlugin
 from expansionStrategy import AnyExpansion, UniformExpansion, Bg_pExpansion, PhysicianDeltaExpansion
+from timing import Stopwatch, format_times
 import sys
 
 
@@ -22,12 +23,13 @@ class iothVBBoxPerNodulePipeline(Pipeline):
                                                   self.config.mask_pattern,
                                                   self.config.dst_image_path,
                                                   self.config.dst_mask_path,
-                                                  internal=self.config.internal_input)
+                                                  internal=self.config.internal_input,
+                                                  prefetch=self.config.prefetchCases)
         myNiftiManagement.masks2read()
         self.plugins_stack.append(myNiftiManagement)
 
         # Plugin Labeling
-        myLabeling = LabelPlugin('CT_mask_labeled', [myNiftiManagement.name])
+        myLabeling = LabelPlugin('CT_mask_labeled', [myNiftiManagement.name], crop=self.config.labeling_crop)
         dim_x, dim_y, dim_z = get_components(self.config.labeling_se_dim)
         myLabeling.set_structure_element(dim_x, dim_y, dim_z)
         self.plugins_stack.append(myLabeling)
@@ -36,6 +38,12 @@ class iothVBBoxPerNodulePipeline(Pipeline):
         myVolumeBBox = VolumeBBoxPlugin('CT_mask_vbbox', [myLabeling.name])
         self.plugins_stack.append(myVolumeBBox)
 
+        # Plugin ComponentStats: the small components are pruned before expanding and saving them.
+        myComponentStats = ComponentStatsPlugin('CT_mask_vbbox_pruned', [myLabeling.name, myVolumeBBox.name],
+                                                min_volume=self.config.component_min_volume,
+                                                max_count=self.config.component_max_count)
+        self.plugins_stack.append(myComponentStats)
+
 
         # Plugin ExpandVBBox
         myExpansion = PhysicianDeltaExpansion('physicianDeltaExpansion',
@@ -51,7 +59,7 @@ class iothVBBoxPerNodulePipeline(Pipeline):
 
 
         myExpandVBBoxOne = ExpandVBBoxPlugin('CT_mask_vbbox_expansion',
-                                             [myLabeling.name, myVolumeBBox.name],
+                                             [myLabeling.name, myComponentStats.name],
                                              myExpansion)
 
         self.plugins_stack.append(myExpandVBBoxOne)
@@ -65,15 +73,16 @@ class iothVBBoxPerNodulePipeline(Pipeline):
         print("Running iothVBBoxPerNodulePipeline...")
         continueProcessing = True
 
-        start_time = time.process_time()  # process_time does not include time elapsed during sleep.
+        stopwatch = Stopwatch()
 
         while continueProcessing:
             continueProcessing = super().execute_stack()
             print("--------------------------------------------------------------------")
 
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        elapsed_time /= 60  # to minutes
-        print("Elapsed time for the FeatureExtractionProcessing: {:.2f} minutes.".format(elapsed_time))
+        super().close_stack()
+
+        print("Elapsed time for the FeatureExtractionProcessing: {}.".format(format_times(stopwatch.stop())))
+        self.report_timings()
 
 
 def debug_test():
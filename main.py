@@ -1,6 +1,28 @@
 import argparse
 from configuration import Configuration
-from pipeline import FeatureExtractionPipeline
+from pipeline import VBBoxPerNodulePipeline, VBBoxPerNoduleOnlyMaskPipeline, FeatureExtractionPipeline, CaseParallelRunner
+from iothPipeline import iothVBBoxPerNodulePipeline
+from workQueue import FileWorkQueue
+
+# Pipeline run by each action: {action: (pipeline class, name)}.
+PIPELINES = {'extract features': (FeatureExtractionPipeline, 'FeatureExtractionProcessing'),
+             'ROI': (VBBoxPerNodulePipeline, 'VBBoxPerNodulePipeline'),
+             'ROI only mask': (VBBoxPerNoduleOnlyMaskPipeline, 'VBBoxPerNoduleOnlyMaskPipeline'),
+             'ioth ROI': (iothVBBoxPerNodulePipeline, 'iothVBBoxPerNodulePipeline')}
+
+def run_pipeline(pipelineClass, name, config, config_file, action):
+    if config.workQueuePath is not None:
+        # Any number of processes (in this node or others) can run with the same shared work queue.
+        myPipeline = pipelineClass(name, config)
+        myPipeline.build_stack()
+        myPipeline.run_queue(FileWorkQueue(config.workQueuePath, config.workQueueStaleTime))
+    elif config.caseWorkers > 1:
+        myRunner = CaseParallelRunner(pipelineClass, name, config_file, action, config.caseWorkers)
+        myRunner.run()
+    else:
+        myPipeline = pipelineClass(name, config)
+        myPipeline.build_stack()
+        myPipeline.run()
 
 def main ():
     parser = argparse.ArgumentParser(description='lc3d')
@@ -8,7 +30,7 @@ def main ():
     #group.add_argument('-v', "--verbose", action="store_true")
     #group.add_argument("-q", "--quiet", action="store_true")
     parser.add_argument('-c', '--config_file', type=str, default=None, help='Configuration file')
-    parser.add_argument('-a', '--action', type=str, default=None, help='extract features')
+    parser.add_argument('-a', '--action', type=str, default=None, help="'extract features', 'ROI', 'ROI only mask' or 'ioth ROI'")
 
     args = parser.parse_args()
 
@@ -21,12 +43,12 @@ def main ():
 
     print("arg.action: {}".format(args.action))
 
-    if args.action == "extract features":
-        print ("Extracting features...")
-        myFeatureExtractionPipeline = FeatureExtractionPipeline('FeatureExtractionProcessing', config)
-        myFeatureExtractionPipeline.build_stack()
-        myFeatureExtractionPipeline.run()
-
+    if args.action in PIPELINES:
+        pipelineClass, name = PIPELINES[args.action]
+        print("Running the pipeline {}...".format(name))
+        run_pipeline(pipelineClass, name, config, args.config_file, args.action)
+    else:
+        print("Unknown action '{}', the actions are: {}".format(args.action, list(PIPELINES.keys())))
 
 if __name__ == '__main__':
     main()
@@ -1,12 +1,21 @@
+import io
+import os
 import sys
 import time
+import queue
+import traceback
+import multiprocessing as mp
+from contextlib import redirect_stdout
 from abc import ABC, abstractmethod
+from configuration import Configuration
 from input import NiftiManagementPlugin, MatlabMaskManagementPlugin
 from utils import get_components
-from plugin import LabelPlugin, VolumeBBoxPlugin, ExpandVBBoxPlugin, SaveVBBoxNiftiPlugin, SlidingWindowPlugin, SaveFeaturesPlugin
+from plugin import LabelPlugin, VolumeBBoxPlugin, ComponentStatsPlugin, ExpandVBBoxPlugin, SaveVBBoxNiftiPlugin, SlidingWindowPlugin, SaveFeaturesPlugin
 from expansionStrategy import UniformExpansion, Bg_pExpansion
 from slidingwindow import SlidingWindow
-from featureExtractionStrategy import RadiomicClass, RadiomicParallelClass
+from featureExtractionStrategy import RadiomicClass, RadiomicParallelClass, VectorizedRadiomicClass
+from featureCache import FeatureCache
+from timing import Stopwatch, format_times, sum_times, write_report
 
 
 class Pipeline(ABC):
@@ -17,6 +26,7 @@ class Pipeline(ABC):
         self.show_total_time = True
         self.plugins_stack = []
         self.data = {}
+        self.timings = []   # times of each case and of each plugin, see execute_stack() and report_timings().
         super().__init__()
 
     @abstractmethod
@@ -24,28 +34,84 @@ class Pipeline(ABC):
         pass
 
     def execute_stack(self):
-        total_time = 0
+        source = self.plugins_stack[0]
+        case = source.src_mask_list[source.index] if source.index < len(source.src_mask_list) else None
+        plugin_times = []
 
         idx = 0
         continueProcessing = True
 
         while idx != len(self.plugins_stack) and continueProcessing:
             plugin = self.plugins_stack[idx]
-            start_time = time.process_time()  # process_time does not include time elapsed during sleep.
+            stopwatch = Stopwatch()  # wall, cpu and children cpu times, the work of the pools is done by the children.
             continueProcessing = plugin.process(self.data)
-            elapsed_time = time.process_time() - start_time  # it measures in seconds
-            #elapsed_time *= 1000  # to milliseconds
+            times = stopwatch.stop()
             if self.show_plugin_time:
-                print("  Elapsed time for the plugin '{}': {:.2f} seconds.".format(plugin.name, elapsed_time))
-            total_time += elapsed_time
+                print("  Elapsed time for the plugin '{}': {}.".format(plugin.name, format_times(times)))
+            plugin_times.append(dict(plugin=plugin.name, **times))
             idx += 1
 
+        total = sum_times(plugin_times)
         if self.show_total_time:
             print("--------------------------------------------------------------------")
-            print("Elapsed time for the plugins stack: {:.2f} seconds.".format(total_time))
+            print("Elapsed time for the plugins stack: {}.".format(format_times(total)))
+
+        if case is not None:
+            self.timings.append({'case': case, 'total': total, 'plugins': plugin_times})
 
         return continueProcessing
 
+    def report_timings(self, suffix=None):
+        # Write the JSON report of the times of the cases processed so far, if it is enabled in the configuration.
+        if self.config.timingReport is None or not self.timings:
+            return
+
+        filename = self.config.timingReport
+        if suffix is not None:
+            root, ext = os.path.splitext(filename)
+            filename = '{}.{}{}'.format(root, suffix, ext)
+        write_report(filename, self.name, self.timings)
+
+    def close_stack(self):
+        # Let each plugin release its resources (e.g. pools of processes) once all the cases are done.
+        for plugin in self.plugins_stack:
+            plugin.close()
+
+    def run_queue(self, workQueue):
+        """
+        Process the cases claimed from a FileWorkQueue shared with other processes or nodes, instead of all the cases
+        of the first plugin (NiftiManagementPlugin or MatlabMaskManagementPlugin), until there is not any pending case.
+        """
+        print("Running {} from the work queue {}...".format(self.name, workQueue.queue_path))
+        source = self.plugins_stack[0]
+        workQueue.populate(source.src_mask_list)
+
+        processed = 0
+        while True:
+            workQueue.requeue_stale()
+            claim = workQueue.claim()
+            if claim is None:
+                break
+
+            print("Claimed the case: {}".format(claim[0]))
+            source.src_mask_list = [claim[0]]
+            source.index = 0
+            with workQueue.heartbeat(claim):
+                try:
+                    self.execute_stack()
+                except Exception:
+                    error = traceback.format_exc()
+                    print(error)
+                    workQueue.fail(claim, error)
+                else:
+                    workQueue.complete(claim)
+            processed += 1
+            print("--------------------------------------------------------------------")
+
+        self.close_stack()
+        self.report_timings(suffix=workQueue.owner)  # a report per process, the queue is shared by several ones.
+        print("Processed {} cases, state of the work queue: {}".format(processed, workQueue.counts()))
+
 
 class VBBoxPerNodulePipeline(Pipeline):
     def __init__(self, name, config):
@@ -61,13 +127,14 @@ class VBBoxPerNodulePipeline(Pipeline):
                                                         self.config.mask_pattern,
                                                         self.config.dst_image_path,
                                                         self.config.dst_mask_path,
-                                                        internal=self.config.internal_input)
+                                                        internal=self.config.internal_input,
+                                                        prefetch=self.config.prefetchCases)
 
         myNiftiManagementPlugin.masks2read()
         self.plugins_stack.append(myNiftiManagementPlugin)
 
         # Plugin Labeling
-        myLabeling = LabelPlugin('CT_mask_labeled', [myNiftiManagementPlugin.name])
+        myLabeling = LabelPlugin('CT_mask_labeled', [myNiftiManagementPlugin.name], crop=self.config.labeling_crop)
         dim_x, dim_y, dim_z = get_components(self.config.labeling_se_dim)
         myLabeling.set_structure_element(dim_x, dim_y, dim_z)
         self.plugins_stack.append(myLabeling)
@@ -76,9 +143,15 @@ class VBBoxPerNodulePipeline(Pipeline):
         myVolumeBBox = VolumeBBoxPlugin('CT_mask_vbbox', [myLabeling.name])
         self.plugins_stack.append(myVolumeBBox)
 
+        # Plugin ComponentStats: the small components are pruned before expanding and saving them.
+        myComponentStats = ComponentStatsPlugin('CT_mask_vbbox_pruned', [myLabeling.name, myVolumeBBox.name],
+                                                min_volume=self.config.component_min_volume,
+                                                max_count=self.config.component_max_count)
+        self.plugins_stack.append(myComponentStats)
+
         # Plugin ExpandVBBoxPlugin: instance num. 1
         myUniformExpansion = UniformExpansion('UniformExpansion', self.config.uniform_nvoxels, self.config.uniform_limit)
-        myExpandVBBoxOne = ExpandVBBoxPlugin('CT_mask_vbbox_uniform_expansion', [myLabeling.name, myVolumeBBox.name], myUniformExpansion)
+        myExpandVBBoxOne = ExpandVBBoxPlugin('CT_mask_vbbox_uniform_expansion', [myLabeling.name, myComponentStats.name], myUniformExpansion)
         self.plugins_stack.append(myExpandVBBoxOne)
 
 
@@ -102,15 +175,16 @@ class VBBoxPerNodulePipeline(Pipeline):
         print("Running VBBoxPerNoduleProcessing...")
         continueProcessing = True
 
-        start_time = time.process_time()  # process_time does not include time elapsed during sleep.
+        stopwatch = Stopwatch()
 
         while continueProcessing:
             continueProcessing = super().execute_stack()
             print("--------------------------------------------------------------------")
 
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        elapsed_time /= 60  # to minutes
-        print("Elapsed time for the FeatureExtractionProcessing: {:.2f} minutes.".format(elapsed_time))
+        super().close_stack()
+
+        print("Elapsed time for the FeatureExtractionProcessing: {}.".format(format_times(stopwatch.stop())))
+        self.report_timings()
 
 
 
@@ -133,7 +207,7 @@ class VBBoxPerNoduleOnlyMaskPipeline(Pipeline):
         self.plugins_stack.append(myMatlabMaskManagementPlugin)
 
         # Plugin Labeling
-        myLabeling = LabelPlugin('CT_mask_labeled', [myMatlabMaskManagementPlugin.name])
+        myLabeling = LabelPlugin('CT_mask_labeled', [myMatlabMaskManagementPlugin.name], crop=self.config.labeling_crop)
         dim_x, dim_y, dim_z = get_components(self.config.labeling_se_dim)
         myLabeling.set_structure_element(dim_x, dim_y, dim_z)
         self.plugins_stack.append(myLabeling)
@@ -142,10 +216,16 @@ class VBBoxPerNoduleOnlyMaskPipeline(Pipeline):
         myVolumeBBox = VolumeBBoxPlugin('CT_mask_vbbox', [myLabeling.name])
         self.plugins_stack.append(myVolumeBBox)
 
+        # Plugin ComponentStats: the small components are pruned before expanding and saving them.
+        myComponentStats = ComponentStatsPlugin('CT_mask_vbbox_pruned', [myLabeling.name, myVolumeBBox.name],
+                                                min_volume=self.config.component_min_volume,
+                                                max_count=self.config.component_max_count)
+        self.plugins_stack.append(myComponentStats)
+
         # Plugin ExpandVBBoxPlugin: instance num. 1
         myUniformExpansion = UniformExpansion('UniformExpansion', self.config.uniform_nvoxels,
                                               self.config.uniform_limit)
-        myExpandVBBoxOne = ExpandVBBoxPlugin('CT_mask_vbbox_uniform_expansion', [myLabeling.name, myVolumeBBox.name],
+        myExpandVBBoxOne = ExpandVBBoxPlugin('CT_mask_vbbox_uniform_expansion', [myLabeling.name, myComponentStats.name],
                                              myUniformExpansion)
         self.plugins_stack.append(myExpandVBBoxOne)
 
@@ -172,15 +252,16 @@ class VBBoxPerNoduleOnlyMaskPipeline(Pipeline):
         print("Running VBBoxPerNoduleOnlyMaskProcessing...")
         continueProcessing = True
 
-        start_time = time.process_time()  # process_time does not include time elapsed during sleep.
+        stopwatch = Stopwatch()
 
         while continueProcessing:
             continueProcessing = super().execute_stack()
             print("--------------------------------------------------------------------")
 
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        elapsed_time /= 60  # to minutes
-        print("Elapsed time for the VBBoxPerNoduleOnlyMaskProcessing: {:.2f} minutes.".format(elapsed_time))
+        super().close_stack()
+
+        print("Elapsed time for the VBBoxPerNoduleOnlyMaskProcessing: {}.".format(format_times(stopwatch.stop())))
+        self.report_timings()
 
 
 class FeatureExtractionPipeline(Pipeline):
@@ -196,7 +277,8 @@ class FeatureExtractionPipeline(Pipeline):
                                                   self.config.mask_pattern,
                                                   self.config.dst_image_path,
                                                   self.config.dst_mask_path,
-                                                  internal=self.config.internal_input)
+                                                  internal=self.config.internal_input,
+                                                  prefetch=self.config.prefetchCases)
         myNiftiManagementPlugin.masks2read()
         self.plugins_stack.append(myNiftiManagementPlugin)
 
@@ -209,16 +291,33 @@ class FeatureExtractionPipeline(Pipeline):
                                         axes=None,
                                         toend=True)
 
-        #myRadiomic = RadiomicClass('Radiomic')
-        myRadiomic = RadiomicParallelClass('Radiomic', self.config.radiomicNCores)
+        if self.config.radiomicStrategy == 'serial':
+            myRadiomic = RadiomicClass('Radiomic')
+        elif self.config.radiomicStrategy == 'vectorized':
+            myRadiomic = VectorizedRadiomicClass('VectorizedRadiomic', self.config.vectorizedChunkSize,
+                                                 self.config.globalDiscretization, self.config.slidingFirstOrder,
+                                                 self.config.slidingGLCM)
+        else:
+            myRadiomic = RadiomicParallelClass('Radiomic', self.config.radiomicNCores, self.config.radiomicChunkSize,
+                                               self.config.checkpointPath, self.config.checkpointInterval)
 
         myRadiomic.build_mask_trick(self.config.window_size)
+        myRadiomic.build_window_selection(self.config.windowHalo)
+        myRadiomic.build_window_memo(self.config.windowMemoSize)
+        myRadiomic.build_feature_table(self.config.featureDtype)
+        myRadiomic.build_feature_profile(self.config.featureClassProfile)
         myRadiomic.build_extractor(self.config.radiomicConfigFile)
 
+        myFeatureCache = None
+        if self.config.featureCachePath is not None:
+            myFeatureCache = FeatureCache(self.config.featureCachePath, self.config.featureCacheMaxSize,
+                                          self.config.radiomicConfigFile)
+
         mySlidingWindowPlugin = SlidingWindowPlugin('SlidingWindowPlugin',
                                                     [myNiftiManagementPlugin.name],
                                                     slidingWindow=mySlidingWindow,
-                                                    strategy=myRadiomic)
+                                                    strategy=myRadiomic,
+                                                    featureCache=myFeatureCache)
         self.plugins_stack.append(mySlidingWindowPlugin)
 
         # Plugin SaveFeaturesPlugin
@@ -263,15 +362,176 @@ class FeatureExtractionPipeline(Pipeline):
         print("Running FeatureExtractionProcessing...")
         continueProcessing = True
 
-        start_time = time.process_time()  # process_time does not include time elapsed during sleep.
+        stopwatch = Stopwatch()
 
         while continueProcessing:
             continueProcessing = super().execute_stack()
             print("--------------------------------------------------------------------")
 
-        elapsed_time = time.process_time() - start_time  # it measures in seconds
-        elapsed_time /= 60  # to minutes
-        print("Elapsed time for the FeatureExtractionProcessing: {:.2f} minutes.".format(elapsed_time))
+        super().close_stack()
+
+        print("Elapsed time for the FeatureExtractionProcessing: {}.".format(format_times(stopwatch.stop())))
+        self.report_timings()
+
+
+def case_worker(pipelineClass, name, config_file, action, tasks, outcomes, ncores=None):
+    """
+    Worker of CaseParallelRunner: it builds its own pipeline (plugins stack and data dict) only once, then it runs the
+    stack for each case received from the tasks queue, capturing what it prints. A None task stops the worker. The
+    last outcome is always (None, pid, ...), even when the worker fails, then the runner knows that it is done. ncores
+    replaces the radiomicNCores of the configuration (see CaseParallelRunner.worker_cores()).
+    """
+    try:
+        config = Configuration(config_file, action).load()
+        if ncores is not None:
+            config.radiomicNCores = ncores
+        pipeline = pipelineClass(name, config)
+        pipeline.build_stack()
+        source = pipeline.plugins_stack[0]  # NiftiManagementPlugin or MatlabMaskManagementPlugin
+
+        while True:
+            case = tasks.get()
+            if case is None:
+                break
+
+            log = io.StringIO()
+            error = None
+            record = None
+            stopwatch = Stopwatch()
+            with redirect_stdout(log):
+                source.src_mask_list = [case]
+                source.index = 0
+                try:
+                    pipeline.execute_stack()
+                    record = pipeline.timings.pop()     # times of this case and of its plugins, for the report.
+                except Exception:
+                    error = traceback.format_exc()
+
+            outcomes.put((case, os.getpid(), log.getvalue(), stopwatch.stop(), record, error))
+
+        pipeline.close_stack()
+    except Exception:
+        print("Worker {} failed:\n{}".format(os.getpid(), traceback.format_exc()))
+    finally:
+        outcomes.put((None, os.getpid(), '', None, None, None))  # this worker is done.
+
+
+class CaseParallelRunner():
+    """
+    Run a pipeline over its cases (the src_mask_list of its first plugin) with nworkers processes. Each worker has its
+    own plugins stack and data dict and takes the next case as soon as it finishes the previous one. The log of each
+    case is printed as a block when the case is done, followed by a summary of the times.
+    """
+    def __init__(self, pipelineClass, name, config_file, action, nworkers, poll_time=5):
+        self.pipelineClass = pipelineClass
+        self.name = name
+        self.config_file = config_file
+        self.action = action
+        self.nworkers = nworkers
+        self.poll_time = poll_time  # seconds between two checks of the workers while waiting for the outcomes.
+        self.times = []
+        self.records = []
+        self.failed = []
+        self.processed = set()
+
+    def cases(self):
+        source = self.pipelineClass(self.name, Configuration(self.config_file, self.action).load())
+        source.build_stack()
+        cases = list(source.plugins_stack[0].src_mask_list)
+        source.close_stack()
+        return cases
+
+    def worker_cores(self):
+        # With the 'parallel' strategy each worker starts its own pool of radiomicNCores processes, then the cores of
+        # the pools are lowered to share the CPUs between the workers. It returns None if the strategy has no pool.
+        config = Configuration(self.config_file, self.action).load()
+        if getattr(config, 'radiomicStrategy', None) != 'parallel':
+            return None
+
+        ncores = max(1, min(config.radiomicNCores, (os.cpu_count() or 1) // self.nworkers))
+        if ncores < config.radiomicNCores:
+            print("Warning: {} workers x {} radiomicNCores exceed the {} CPUs, each worker uses a pool of {} cores.".format(
+                self.nworkers, config.radiomicNCores, os.cpu_count(), ncores))
+        return ncores
+
+    def report_outcome(self, outcome):
+        case, pid, log, caseTimes, record, error = outcome
+        print("==================== Case {} (worker {}) ====================".format(case, pid))
+        print(log, end='')
+        if error is not None:
+            print(error, end='')
+            self.failed.append(case)
+        print("Case {} done: {}.".format(case, format_times(caseTimes)))
+        self.processed.add(case)
+        self.times.append(caseTimes)
+        if record is not None:
+            record['worker'] = pid
+            self.records.append(record)
+
+    def run(self):
+        print("Running {} over the cases with {} workers...".format(self.name, self.nworkers))
+        start_wall = time.time()
+
+        cases = self.cases()
+        tasks = mp.Queue()
+        outcomes = mp.Queue()
+        for case in cases:
+            tasks.put(case)
+        for _ in range(self.nworkers):
+            tasks.put(None)
+
+        ncores = self.worker_cores()
+        workers = [mp.Process(target=case_worker, args=(self.pipelineClass, self.name, self.config_file, self.action,
+                                                        tasks, outcomes, ncores)) for _ in range(self.nworkers)]
+        for worker in workers:
+            worker.start()
+
+        # A worker killed (e.g. out of memory) never sends its last outcome, then the workers are checked while waiting.
+        done = set()
+        while len(done) < len(workers):
+            try:
+                outcome = outcomes.get(timeout=self.poll_time)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.pid not in done and not worker.is_alive() and worker.exitcode != 0:
+                        print("Warning: the worker {} exited with code {}.".format(worker.pid, worker.exitcode))
+                        done.add(worker.pid)
+                continue
+
+            if outcome[0] is None:
+                done.add(outcome[1])
+            else:
+                self.report_outcome(outcome)
+
+        # The outcomes already sent by a worker that has died are still in the queue.
+        while True:
+            try:
+                outcome = outcomes.get(timeout=0.1)
+            except queue.Empty:
+                break
+            if outcome[0] is not None:
+                self.report_outcome(outcome)
+
+        for worker in workers:
+            worker.join()
+
+        lost = [case for case in cases if case not in self.processed]
+        if lost:
+            print("Warning: the cases {} were not reported by a worker that has died, they must be run again.".format(lost))
+            self.failed.extend(lost)
+
+        elapsed_time = time.time() - start_wall
+        print("--------------------------------------------------------------------")
+        print("Processed {} cases with {} workers in {:.2f} minutes.".format(len(self.times), self.nworkers, elapsed_time / 60))
+        total = sum_times(self.times)
+        print("Sum of the cases: {:.2f} minutes of wall time, {:.2f} minutes of cpu time (speedup: {:.2f}).".format(
+            total['wall'] / 60, (total['cpu'] + total['children_cpu']) / 60, total['wall'] / max(elapsed_time, 1e-9)))
+        if self.failed:
+            print("Failed cases: {}".format(self.failed))
+
+        config = Configuration(self.config_file, self.action).load()
+        if config.timingReport is not None and self.records:
+            write_report(config.timingReport, self.name, self.records)
 
 
 # def debug_test():
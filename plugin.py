@@ -8,8 +8,11 @@ import scipy.io as sio  # to save matlab files (.mat)
 from configuration import Configuration
 from abc import ABC, abstractmethod
 from scipy.ndimage.measurements import label
+from scipy import ndimage
 from imageFormat import NiftiFormat
 from utils import get_dst_filename_nifti
+from featureExtractionStrategy import categorical_column
+from timing import Stopwatch, format_times
 from collections import OrderedDict
 
 
@@ -23,12 +26,17 @@ class Plugin(ABC):
     def process(self, data):
         pass
 
+    def close(self):
+        # Called once all the cases have been processed, by default there is nothing to release.
+        pass
+
 
 class LabelPlugin(Plugin):
-    def __init__(self, name, input_key):
+    def __init__(self, name, input_key, crop=False):
         self.structure_element = None
         self.ncomponents = None
         self.labeled = None
+        self.crop = crop    # label only the bounding box of the foreground, the result is the same.
         super().__init__(name, input_key)
 
     def set_structure_element(self, dim_x, dim_y, dim_z):
@@ -37,6 +45,33 @@ class LabelPlugin(Plugin):
     def get_structure_element(self):
         return self.structure_element
 
+    def foreground_bbox(self, volume):
+        # Slices of the bounding box of the voxels different than 0, or None if there is not any.
+        bbox = []
+        for axis in range(volume.ndim):
+            profile = np.any(volume, axis=tuple(a for a in range(volume.ndim) if a != axis))
+            nonzero = np.flatnonzero(profile)
+            if len(nonzero) == 0:
+                return None
+            bbox.append(slice(nonzero[0], nonzero[-1] + 1))
+        return tuple(bbox)
+
+    def label_cropped(self, volume):
+        """
+        Label only the bounding box of the foreground and place the labels back in a volume of the full size. The
+        labels are numbered following the raster order, and all the foreground is inside the bounding box, then the
+        result is identical to labeling the whole volume.
+        """
+        bbox = self.foreground_bbox(volume)
+        if bbox is None:
+            return np.zeros(volume.shape, dtype=np.int32), 0     # the same than label() without foreground.
+
+        cropped, ncomponents = label(volume[bbox], self.structure_element)
+        print("    Labeling the foreground's bbox {} of the volume {}.".format(cropped.shape, volume.shape))
+
+        labeled = np.zeros(volume.shape, dtype=cropped.dtype)
+        labeled[bbox] = cropped
+        return labeled, ncomponents
 
     def process(self, data):
         print ("> Label plugin with name: '{}' ... ".format(self.name))
@@ -51,7 +86,10 @@ class LabelPlugin(Plugin):
             print("    {} is a present key in the data dictionary".format(self.input_key[0]))
             _, self.mask = data[self.input_key[0]]
 
-            self.labeled, self.ncomponents = label(self.mask.volume, self.structure_element)
+            if self.crop:
+                self.labeled, self.ncomponents = self.label_cropped(self.mask.volume)
+            else:
+                self.labeled, self.ncomponents = label(self.mask.volume, self.structure_element)
             print("    Labeling labeled ncomponents: {}".format(self.ncomponents))
 
             # Add the new item to data
@@ -65,10 +103,17 @@ class LabelPlugin(Plugin):
         return False
 
 
+def voxels_key(vbbox_key):
+    # Key of the voxel counts that VolumeBBoxPlugin adds to data next to its vbbox_list (e.g. 'CT_mask_vbbox_voxels').
+    return vbbox_key + '_voxels'
+
+
 class VolumeBBoxPlugin(Plugin):
     def __init__(self, name, input_key):
         self.vbbox_list = []
+        self.voxel_counts = []  # amount of voxels of each label, with the background in the index 0.
         super().__init__(name, input_key)
+        self.voxels_key = voxels_key(self.name)
 
     # Input:  volume (is a mask) where 0 means background and 1 means groundtruth
     # Output: Volume Bounding Box for the volumen: xmin, xma, ymin, ymax, zmin, zmax
@@ -84,12 +129,29 @@ class VolumeBBoxPlugin(Plugin):
 
         return [rmin, rmax, cmin, cmax, zmin, zmax]
 
+    # Input:  labeled volume with the labels from 1 to ncomponents, and 0 as background.
+    # Output: the bbox (xmin, xmax, ymin, ymax, zmin, zmax) of each label and the amount of voxels of each label, both
+    #         computed in one pass over the volume instead of one pass per label.
+    def bboxes_3D(self, labeled, ncomponents):
+        slices = ndimage.find_objects(labeled, max_label=ncomponents)
+        counts = np.bincount(labeled.ravel(), minlength=ncomponents + 1)
+
+        vbboxes = []
+        for s in slices:
+            if s is None:
+                vbboxes.append(None)    # a label without any voxel.
+            else:
+                vbboxes.append([s[0].start, s[0].stop - 1, s[1].start, s[1].stop - 1, s[2].start, s[2].stop - 1])
+
+        return vbboxes, counts.tolist()
+
     def process(self, data):
         print("> VolumeBBoxPlugin plugin with name: '{}' ... ".format(self.name))
 
         # if already exist an item, then remove it.
         if data.get(self.name) is not None:
             data.pop(self.name)
+            data.pop(self.voxels_key, None)
             print("    Removing from data: '{}':vbbox_list".format(self.name))
 
         # self.input_key[0] equal to 'CT_mask_labeled'
@@ -106,15 +168,13 @@ class VolumeBBoxPlugin(Plugin):
                 # This let us to have label '1' in the index 1, label '2' in the index 2, and so on.
                 self.vbbox_list.append(None)
 
-                for i in range(1, ncomponents+1):    # from 1 to (ncomponents+1), with ncomoponents equal to 2 ==> 1,2.
-                    mask = np.zeros(labeled.shape, dtype=np.int)
-                    mask[np.where(labeled==i)]=1
+                # Find the exact position for the volume bounding box of all the labels at once.
+                vbboxes, self.voxel_counts = self.bboxes_3D(labeled, ncomponents)
 
-                    vbbox = self.bbox_3D(mask)   # Find the exact position for the volume bounding box
-                    print("    Label: {} has a volume's bbox (xmin, xmax, ymin, ymax, zmin, zmax) = ({})".format(i, vbbox))
+                for i, vbbox in enumerate(vbboxes, start=1):    # from 1 to ncomponents.
+                    print("    Label: {} has a volume's bbox (xmin, xmax, ymin, ymax, zmin, zmax) = ({}) and {} voxels".format(i, vbbox, self.voxel_counts[i]))
 
                     self.vbbox_list.append(vbbox)
-                    del mask
 
                 # ncomponents does not have included the background.
                 assert (ncomponents + 1) == len(self.vbbox_list), "    In VolumeBBox, ncomponents must be equal to the amount of vbbox."
@@ -122,7 +182,8 @@ class VolumeBBoxPlugin(Plugin):
                 # Add the new item to data
                 #self.name equal to 'CT_mask_vbbox'
                 data[self.name] = self.vbbox_list
-                print("    Adding to data: '{}':vbbox_list".format(self.name))
+                data[self.voxels_key] = self.voxel_counts
+                print("    Adding to data: '{}':vbbox_list and '{}':voxel_counts".format(self.name, self.voxels_key))
                 return True
 
         else:
@@ -132,6 +193,92 @@ class VolumeBBoxPlugin(Plugin):
 
 
 
+class ComponentStatsPlugin(Plugin):
+    """
+    Compute a table with the statistics of all the components (voxels, centroid, bbox and extent), then prune the components with less than min_volume voxels and keep only the max_count largest
+    ones. The vbbox_list of the input is passed on with None in place of the pruned components, then they are neither
+    expanded nor saved.
+    """
+    def __init__(self, name, input_key, min_volume=0, max_count=None):
+        self.min_volume = min_volume    # minimum amount of voxels of a component to be kept.
+        self.max_count = max_count      # maximum amount of components kept (the largest ones), None keeps all of them.
+        self.stats = None
+        self.vbbox_list = []
+        super().__init__(name, input_key)
+
+    def component_stats(self, labeled, ncomponents, vbbox_list, voxel_counts):
+        # The voxels and the bbox of each label were already computed by VolumeBBoxPlugin, only the centroids are
+        # computed here, with the sums of the coordinates of each label accumulated with bincount.
+        voxels = np.asarray(voxel_counts[1:ncomponents + 1])
+        present = np.maximum(voxels, 1)
+
+        stats = OrderedDict()
+        stats['label'] = np.arange(1, ncomponents + 1)
+        stats['voxels'] = voxels
+
+        coords = np.nonzero(labeled)
+        labels = labeled[coords]
+        for axis, c in zip(('x', 'y', 'z'), coords):
+            stats['centroid_' + axis] = np.bincount(labels, weights=c, minlength=ncomponents + 1)[1:ncomponents + 1] / present
+
+        # A label without any voxel has no bbox (None), then it gets an empty one.
+        vbboxes = np.array([vbbox if vbbox is not None else [0, -1] * 3 for vbbox in vbbox_list[1:ncomponents + 1]],
+                           dtype=np.int64).reshape(-1, 6)
+        for i, axis in enumerate(('x', 'y', 'z')):
+            stats[axis + 'min'] = vbboxes[:, 2 * i]
+            stats[axis + 'max'] = vbboxes[:, 2 * i + 1]
+
+        extent = np.prod(vbboxes[:, 1::2] - vbboxes[:, 0::2] + 1, axis=1)
+        stats['extent'] = voxels / np.maximum(extent, 1)    # fraction of the bbox filled by the component.
+
+        return pd.DataFrame(stats)
+
+    def select(self, stats):
+        # Labels kept: at least min_volume voxels and, if max_count is set, only the largest ones.
+        kept = stats[stats['voxels'] >= self.min_volume]
+        if self.max_count is not None:
+            kept = kept.sort_values(['voxels', 'label'], ascending=[False, True], kind='stable').head(self.max_count)
+        return set(kept['label'].tolist())
+
+    def process(self, data):
+        print("> ComponentStats plugin with name: '{}' ... ".format(self.name))
+
+        # if already exist an item, then remove it.
+        if data.get(self.name) is not None:
+            data.pop(self.name)
+            print("    Removing from data: '{}':vbbox_list".format(self.name))
+
+        # self.input_key[0] equal to 'CT_mask_labeled' and self.input_key[1] equal to 'CT_mask_vbbox' (with the voxel
+        # counts in 'CT_mask_vbbox_voxels')
+        if (self.input_key[0] in data) and (self.input_key[1] in data) and (voxels_key(self.input_key[1]) in data):
+            print("    {} and {} are present keys in the data dictionary".format(self.input_key[0], self.input_key[1]))
+            labeled, ncomponents = data[self.input_key[0]]
+            vbbox_list = data[self.input_key[1]]
+            voxel_counts = data[voxels_key(self.input_key[1])]
+
+            self.stats = self.component_stats(labeled, ncomponents, vbbox_list, voxel_counts)
+            kept = self.select(self.stats)
+
+            self.vbbox_list = [vbbox if label_number in kept else None for label_number, vbbox in enumerate(vbbox_list)]
+
+            for row in self.stats.itertuples(index=False):
+                print("    Label: {} has {} voxels, centroid ({:.1f}, {:.1f}, {:.1f}) and extent {:.2f}{}".format(
+                    row.label, row.voxels, row.centroid_x, row.centroid_y, row.centroid_z, row.extent,
+                    '' if row.label in kept else ', pruned.'))
+            print("    Keeping {} of {} components (min_volume: {}, max_count: {}).".format(
+                len(kept), ncomponents, self.min_volume, self.max_count))
+
+            # Add the new item to data
+            data[self.name] = self.vbbox_list
+            print("    Adding to data: '{}':vbbox_list".format(self.name))
+            return True
+
+        else:
+            print("    Error: In ComponentStats, process() method does not found {} and {} keys to process.".format(self.input_key[0], self.input_key[1]))
+
+        return False
+
+
 class ExpandVBBoxPlugin(Plugin):
     def __init__(self, name, input_key, strategy):
         self.strategy = strategy        # this is the particular expansion strategy.
@@ -162,7 +309,9 @@ class ExpandVBBoxPlugin(Plugin):
             vbbox_list = data[self.input_key[1]]  # list with minimals vbboxes.
 
             for label_number, minimal_vbbox in enumerate(vbbox_list):
-                if label_number != 0:
+                if minimal_vbbox is None and label_number != 0:
+                    self.expanded_vbbox_list.append(None)   # pruned component (see ComponentStatsPlugin).
+                elif label_number != 0:
                     print("    Label: {}".format(label_number))
                     vbbox = self.context_interface(labeled, minimal_vbbox, ncomponents, label_number)
                     self.expanded_vbbox_list.append(vbbox)
@@ -212,7 +361,7 @@ class SaveVBBoxNiftiPlugin(Plugin):
             # check image and mask must be object from MyNifti class.
 
             for label_number, vbbox in enumerate(vbbox_list):
-                if label_number != 0:       # skipping the background, which has a label = 0.
+                if label_number != 0 and vbbox is not None:     # skipping the background and the pruned components.
 
                     # Get the names for the image and mask
                     if self.internal == 3:
@@ -259,9 +408,10 @@ class SaveVBBoxNiftiPlugin(Plugin):
 
 
 class SlidingWindowPlugin(Plugin):
-    def __init__(self, name, input_key, slidingWindow, strategy):
+    def __init__(self, name, input_key, slidingWindow, strategy, featureCache=None):
         self.slidingWindow = slidingWindow
         self.strategy = strategy
+        self.featureCache = featureCache    # FeatureCache object, None to always compute the features.
         self.image = None
         self.mask = None
         self.image_filename = ''
@@ -270,10 +420,14 @@ class SlidingWindowPlugin(Plugin):
         self.lessionID = -1
         super().__init__(name, input_key)
 
-    def context_interface(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction):
-        df = self.strategy.featureExtraction(array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction)
+    def context_interface(self, array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction, padded_volume):
+        df = self.strategy.featureExtraction(array, mask, image_filename, mask_filename, caseID, lessionID, origin, spacing, direction,
+                                             padded_volume=padded_volume, slidingWindow=self.slidingWindow)
         return df
 
+    def close(self):
+        self.strategy.close()
+
     def process(self, data):
         print("> SlidingWindow plugin with name: {} using strategy {} ...".format(self.name, self.strategy.name))
 
@@ -292,6 +446,23 @@ class SlidingWindowPlugin(Plugin):
             # print("   >> spacing: {}".format(self.image.spacing))
             # print("   >> direction: {}".format(self.image.direction))
 
+            # The features of the same image, mask and parameters are loaded from the cache instead of recomputed.
+            cacheKey = None
+            if self.featureCache is not None:
+                cacheKey = self.featureCache.key(self.image.volume, self.mask.volume, self.slidingWindow, self.strategy)
+                df = self.featureCache.load(cacheKey)
+                if df is not None:
+                    # The table is shared by identical cases, then the identification of this case is restored.
+                    df['image_filename'] = categorical_column(self.image.filename, len(df))
+                    df['mask_filename'] = categorical_column(self.mask.filename, len(df))
+                    df['caseID'] = self.image.caseID
+                    df['lessionID'] = self.image.lessionID
+
+                    data[self.name] = [df]
+                    print("    Features loaded from the cache: {}.".format(self.featureCache.filename(cacheKey)))
+                    print("    Adding to data: '{}':[df]".format(self.name))
+                    return True
+
             # adding Pad to the volume
             newVolume = self.slidingWindow.padding(self.image.volume)
             print("    The initial volume's shape is: {}.".format(self.image.volume.shape))
@@ -300,19 +471,21 @@ class SlidingWindowPlugin(Plugin):
             # little_cubes will contains all the small volumes generated
             # after the window have been shifted throughout the volume.
             # By the way, little_cubes is an numpy object.
-            start_time = time.process_time()
+            stopwatch = Stopwatch()
             little_cubes = self.slidingWindow.rolling_window(newVolume)
-            elapsed_time = time.process_time() - start_time  # it measures in seconds
 
 
-            print("    little_cubes.shape : {}, computed in: {:.2f} seconds.".format(little_cubes.shape, elapsed_time))
+            print("    little_cubes.shape : {}, computed in: {}.".format(little_cubes.shape, format_times(stopwatch.stop())))
 
 
             if little_cubes is not None:
                 # extract features and save them.
-                df = self.context_interface(little_cubes, self.mask.volume, self.image.filename, self.mask.filename, self.image.caseID, self.image.lessionID, self.image.origin, self.image.spacing, self.image.direction)
+                df = self.context_interface(little_cubes, self.mask.volume, self.image.filename, self.mask.filename, self.image.caseID, self.image.lessionID, self.image.origin, self.image.spacing, self.image.direction, newVolume)
                 #self.strategy.featureExtraction(little_cubes)
 
+                if cacheKey is not None and df is not None:
+                    self.featureCache.store(cacheKey, df)
+
                 # Add the new item to data
                 data[self.name] = [df]
                 print("    Adding to data: '{}':[df]".format(self.name))
@@ -417,7 +590,8 @@ class SaveFeaturesPlugin(Plugin):
 
                         index = np.array(df['flattened_index'])  # recover indexes and cast to numpy array.
 
-                        feature2 = 0*feature
+                        # the windows that were not evaluated (see windowHalo) are left to 0.
+                        feature2 = np.zeros(x * y * z, dtype=feature.dtype)
                         feature2[index] = feature
                         feature2 = feature2.reshape(x, y, z)
 
@@ -0,0 +1,55 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from workQueue import FileWorkQueue
+
+
+class ClaimTest(unittest.TestCase):
+    def setUp(self):
+        self.queue_path = tempfile.mkdtemp()
+        self.queue = FileWorkQueue(self.queue_path, stale_time=60)
+        self.other = FileWorkQueue(self.queue_path, stale_time=60)  # a worker of another node.
+
+        # A case populated long ago: its file is older than stale_time.
+        self.queue.populate(['case1.nii.gz'])
+        old = time.time() - 10 * self.queue.stale_time
+        os.utime(os.path.join(self.queue.folder('pending'), 'case1.nii.gz'), (old, old))
+
+    def tearDown(self):
+        shutil.rmtree(self.queue_path)
+
+    def claim_with_concurrent_requeue(self, other):
+        # The other worker runs requeue_stale() right after the rename of claim().
+        rename = os.rename
+
+        def rename_then_requeue(src, dst):
+            rename(src, dst)
+            if os.path.dirname(dst) == self.queue.folder('claimed'):
+                with mock.patch('os.rename', rename):
+                    other.requeue_stale()
+
+        with mock.patch('os.rename', rename_then_requeue):
+            return self.queue.claim()
+
+    def test_new_claim_is_not_stale(self):
+        claim = self.claim_with_concurrent_requeue(self.other)
+
+        self.assertEqual(claim[0], 'case1.nii.gz')
+        self.assertTrue(os.path.exists(claim[1]))
+        self.assertEqual(self.queue.counts()['pending'], 0)
+
+    def test_lost_claim_is_skipped(self):
+        # Every claim is stale for this worker, then it re-queues the new claim: claim() goes on instead of raising.
+        self.other.stale_time = -1
+        claim = self.claim_with_concurrent_requeue(self.other)
+
+        self.assertIsNone(claim)
+        self.assertEqual(self.queue.counts(), {'pending': 1, 'claimed': 0, 'done': 0, 'failed': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
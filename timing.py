@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import weakref
+import resource
+import multiprocessing as mp
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_stat(pid):
+    # Fields of /proc/<pid>/stat after the name of the command (None if it is not available).
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+
+def process_cpu(pid):
+    # CPU seconds (user + system) consumed so far by a running process, read from /proc (0 if it is not available).
+    fields = process_stat(pid)
+    if fields is None:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def is_child(pid):
+    # The processes started from a forkserver are not children of this process: their rusage never arrives here.
+    fields = process_stat(pid)
+    return fields is not None and int(fields[1]) == os.getpid()
+
+
+# CPU seconds reported by the worker processes that are not children of this process, see report_worker_usage().
+reported_cpu = 0.0
+
+
+def report_worker_usage(pid, cpu, peak):
+    """
+    Add the usage that a worker of a pool measured by itself for a block of work: its CPU seconds and its peak RSS in
+    bytes. The CPU is only added for the workers that are not children of this process (e.g. the pool of
+    RadiomicParallelClass started from a forkserver), the ones of the children are already read by children_cpu().
+    """
+    global reported_cpu
+    if not is_child(pid):
+        reported_cpu += cpu
+    for stopwatch in running_stopwatches:
+        stopwatch.children_max_rss = max(stopwatch.children_max_rss, peak)
+
+
+def children_cpu():
+    """
+    CPU seconds consumed by the child processes: the ones already finished (rusage of the children) plus the ones
+    still running, e.g. the workers of a pool, which are not included in the rusage until they are joined. The
+    workers started from a forkserver are counted from their own reports (see report_worker_usage()).
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = usage.ru_utime + usage.ru_stime + reported_cpu
+    for child in mp.active_children():
+        if is_child(child.pid):
+            cpu += process_cpu(child.pid)
+    return cpu
+
+
+def process_peak_rss(pid='self'):
+    # Peak resident set size in bytes of a running process since its last reset (see reset_peak_rss()), read from /proc
+    # (0 if it is not available).
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    # Peak resident set size in bytes (ru_maxrss is in kilobytes on Linux and in bytes on macOS).
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def children_peak_rss():
+    # The largest peak RSS of the child processes still running (e.g. the workers of a pool).
+    return max([0] + [process_peak_rss(child.pid) for child in mp.active_children()])
+
+
+def clear_peak_rss(pid='self'):
+    # Reset the peak RSS of a process to its current RSS (Linux >= 4.0). It returns False if it is not supported.
+    try:
+        with open('/proc/{}/clear_refs'.format(pid), 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+# Stopwatches started and not stopped yet. The peak RSS is reset when a stopwatch starts, then the peaks reached so far
+# are kept in the ones still running (e.g. the stopwatch of a whole run contains the ones of its plugins).
+running_stopwatches = weakref.WeakSet()
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process and of its running children, after saving the current peaks in the stopwatches
+    still running. It returns False if the peaks can not be reset, then only the peaks since the start of each process
+    are available (ru_maxrss).
+    """
+    own, children = process_peak_rss(), children_peak_rss()
+    for stopwatch in running_stopwatches:
+        stopwatch.max_rss = max(stopwatch.max_rss, own)
+        stopwatch.children_max_rss = max(stopwatch.children_max_rss, children)
+
+    for child in mp.active_children():
+        clear_peak_rss(child.pid)
+    return clear_peak_rss()
+
+
+class Stopwatch(object):
+    """
+    Measure the wall time, the CPU time of this process, the CPU time of its children (e.g. the pool of
+    RadiomicParallelClass, whose work is not seen by time.process_time()) and the peak RSS of both while it runs.
+    """
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.max_rss = 0
+        self.children_max_rss = 0
+        self.resettable = reset_peak_rss()
+        self.reaped_rss = peak_rss(resource.RUSAGE_CHILDREN)
+        running_stopwatches.add(self)
+
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.children_cpu = children_cpu()
+
+    def stop(self):
+        # It returns a dict with the times in seconds and the peak RSS in bytes since start(). Where the peaks can not
+        # be reset, they are the peaks since the process started.
+        times = {'wall': time.perf_counter() - self.wall,
+                 'cpu': time.process_time() - self.cpu,
+                 'children_cpu': children_cpu() - self.children_cpu}
+        running_stopwatches.discard(self)
+
+        if self.resettable:
+            times['peak_rss'] = max(self.max_rss, process_peak_rss())
+            times['children_peak_rss'] = max(self.children_max_rss, children_peak_rss())
+            # A child that finished (e.g. a closed pool) is only seen through the lifetime peak of the finished
+            # children, which only tells something about this stopwatch if it has grown since start().
+            reaped_rss = peak_rss(resource.RUSAGE_CHILDREN)
+            if reaped_rss > self.reaped_rss:
+                times['children_peak_rss'] = max(times['children_peak_rss'], reaped_rss)
+        else:
+            times['peak_rss'] = peak_rss(resource.RUSAGE_SELF)
+            times['children_peak_rss'] = max(self.children_max_rss, peak_rss(resource.RUSAGE_CHILDREN),
+                                             children_peak_rss())
+        return times
+
+
+def format_times(times):
+    return "wall {:.2f} s, cpu {:.2f} s, children cpu {:.2f} s, peak rss {:.0f} MB".format(
+        times['wall'], times['cpu'], times['children_cpu'], times['peak_rss'] / 1024 ** 2)
+
+
+def sum_times(times_list):
+    total = {'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0, 'peak_rss': 0, 'children_peak_rss': 0}
+    for times in times_list:
+        for key in ('wall', 'cpu', 'children_cpu'):
+            total[key] += times[key]
+        for key in ('peak_rss', 'children_peak_rss'):
+            total[key] = max(total[key], times[key])
+    return total
+
+
+def write_report(filename, name, cases):
+    """
+    Write the JSON report of a run: the times of each case and of each plugin (see Pipeline.execute_stack()) and
+    their sum. It is written to a temporary file and renamed, then a report is never left half-written.
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    report = {'pipeline': name,
+              'host': os.uname().nodename if hasattr(os, 'uname') else '',
+              'pid': os.getpid(),
+              'written': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'total': sum_times([case['total'] for case in cases]),
+              'cases': cases}
+
+    tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_filename, filename)
+    print("Timing report of {} cases written to: {}".format(len(cases), filename))
@@ -0,0 +1,1096 @@
+import numpy as np
+from collections import OrderedDict
+
+
+# Features computed by pyradiomics when a feature class is enabled with an empty list in the parameters file
+# (i.e. all the features of the class, excluding the deprecated ones).
+FIRSTORDER_FEATURES = ['10Percentile', '90Percentile', 'Energy', 'Entropy', 'InterquartileRange', 'Kurtosis',
+                       'Maximum', 'Mean', 'MeanAbsoluteDeviation', 'Median', 'Minimum', 'Range',
+                       'RobustMeanAbsoluteDeviation', 'RootMeanSquared', 'Skewness', 'TotalEnergy', 'Uniformity',
+                       'Variance']
+
+GLCM_FEATURES = ['Autocorrelation', 'ClusterProminence', 'ClusterShade', 'ClusterTendency', 'Contrast', 'Correlation',
+                 'DifferenceAverage', 'DifferenceEntropy', 'DifferenceVariance', 'Id', 'Idm', 'Idmn', 'Idn', 'Imc1',
+                 'Imc2', 'InverseVariance', 'JointAverage', 'JointEnergy', 'JointEntropy', 'MCC',
+                 'MaximumProbability', 'SumAverage', 'SumEntropy', 'SumSquares']
+
+GLRLM_FEATURES = ['GrayLevelNonUniformity', 'GrayLevelNonUniformityNormalized', 'GrayLevelVariance',
+                  'HighGrayLevelRunEmphasis', 'LongRunEmphasis', 'LongRunHighGrayLevelEmphasis',
+                  'LongRunLowGrayLevelEmphasis', 'LowGrayLevelRunEmphasis', 'RunEntropy', 'RunLengthNonUniformity',
+                  'RunLengthNonUniformityNormalized', 'RunPercentage', 'RunVariance', 'ShortRunEmphasis',
+                  'ShortRunHighGrayLevelEmphasis', 'ShortRunLowGrayLevelEmphasis']
+
+GLSZM_FEATURES = ['GrayLevelNonUniformity', 'GrayLevelNonUniformityNormalized', 'GrayLevelVariance',
+                  'HighGrayLevelZoneEmphasis', 'LargeAreaEmphasis', 'LargeAreaHighGrayLevelEmphasis',
+                  'LargeAreaLowGrayLevelEmphasis', 'LowGrayLevelZoneEmphasis', 'SizeZoneNonUniformity',
+                  'SizeZoneNonUniformityNormalized', 'SmallAreaEmphasis', 'SmallAreaHighGrayLevelEmphasis',
+                  'SmallAreaLowGrayLevelEmphasis', 'ZoneEntropy', 'ZonePercentage', 'ZoneVariance']
+
+GLDM_FEATURES = ['DependenceEntropy', 'DependenceNonUniformity', 'DependenceNonUniformityNormalized',
+                 'DependenceVariance', 'GrayLevelNonUniformity', 'GrayLevelVariance', 'HighGrayLevelEmphasis',
+                 'LargeDependenceEmphasis', 'LargeDependenceHighGrayLevelEmphasis',
+                 'LargeDependenceLowGrayLevelEmphasis', 'LowGrayLevelEmphasis', 'SmallDependenceEmphasis',
+                 'SmallDependenceHighGrayLevelEmphasis', 'SmallDependenceLowGrayLevelEmphasis']
+
+# First order features that can be updated window by window when the windows slide one voxel at a time (see
+# sliding_firstorder_features()), the others need all the voxels of each window.
+SLIDING_FIRSTORDER = ['Energy', 'Entropy', 'Mean', 'RootMeanSquared', 'TotalEnergy', 'Uniformity']
+
+# Deprecated features, only computed when they are explicitly listed in the parameters file.
+FIRSTORDER_DEPRECATED = ['StandardDeviation']
+
+# The 13 directions of a 3D neighbourhood at distance 1 (z, y, x), in the same order than pyradiomics.
+ANGLES_3D = [(1, 1, 1), (1, 1, 0), (1, 1, -1), (1, 0, 1), (1, 0, 0), (1, 0, -1), (1, -1, 1), (1, -1, 0), (1, -1, -1),
+             (0, 1, 1), (0, 1, 0), (0, 1, -1), (0, 0, 1)]
+
+# Amount of cells (window x G x G x angle) of the co-occurrence matrices built at once. The matrices of a window take
+# 13 * G * G cells, where G (up to w ** 3) is the number of gray levels of the block, and the features need several
+# arrays of that size, then the windows of a block are split in smaller blocks to bound the memory.
+MAX_GLCM_CELLS = 2 ** 22
+
+# The sliding co-occurrence counts (see sliding_glcm_features()) keep G x G cells per window, G being the number of
+# gray levels of the whole volume. Above this amount of gray levels the block computation is faster.
+SLIDING_GLCM_MAX_LEVELS = 32
+
+# GLSZM and GLDM use the same formulas over a matrix (gray level, size), where the size is the size of a zone or the
+# dependence of a voxel. {feature name: generic name used by size_matrix_features()}.
+GLSZM_GENERIC = {'SmallAreaEmphasis': 'SmallEmphasis', 'LargeAreaEmphasis': 'LargeEmphasis',
+                 'GrayLevelNonUniformity': 'GrayLevelNonUniformity',
+                 'GrayLevelNonUniformityNormalized': 'GrayLevelNonUniformityNormalized',
+                 'SizeZoneNonUniformity': 'SizeNonUniformity',
+                 'SizeZoneNonUniformityNormalized': 'SizeNonUniformityNormalized',
+                 'ZonePercentage': 'Percentage', 'GrayLevelVariance': 'GrayLevelVariance',
+                 'ZoneVariance': 'SizeVariance', 'ZoneEntropy': 'Entropy',
+                 'LowGrayLevelZoneEmphasis': 'LowGrayLevelEmphasis', 'HighGrayLevelZoneEmphasis': 'HighGrayLevelEmphasis',
+                 'SmallAreaLowGrayLevelEmphasis': 'SmallLowGrayLevelEmphasis',
+                 'SmallAreaHighGrayLevelEmphasis': 'SmallHighGrayLevelEmphasis',
+                 'LargeAreaLowGrayLevelEmphasis': 'LargeLowGrayLevelEmphasis',
+                 'LargeAreaHighGrayLevelEmphasis': 'LargeHighGrayLevelEmphasis'}
+
+GLDM_GENERIC = {'SmallDependenceEmphasis': 'SmallEmphasis', 'LargeDependenceEmphasis': 'LargeEmphasis',
+                'GrayLevelNonUniformity': 'GrayLevelNonUniformity',
+                'DependenceNonUniformity': 'SizeNonUniformity',
+                'DependenceNonUniformityNormalized': 'SizeNonUniformityNormalized',
+                'GrayLevelVariance': 'GrayLevelVariance', 'DependenceVariance': 'SizeVariance',
+                'DependenceEntropy': 'Entropy', 'LowGrayLevelEmphasis': 'LowGrayLevelEmphasis',
+                'HighGrayLevelEmphasis': 'HighGrayLevelEmphasis',
+                'SmallDependenceLowGrayLevelEmphasis': 'SmallLowGrayLevelEmphasis',
+                'SmallDependenceHighGrayLevelEmphasis': 'SmallHighGrayLevelEmphasis',
+                'LargeDependenceLowGrayLevelEmphasis': 'LargeLowGrayLevelEmphasis',
+                'LargeDependenceHighGrayLevelEmphasis': 'LargeHighGrayLevelEmphasis'}
+
+# Neighbourhood tables already built, by window shape (see neighbourhood_table()).
+_NEIGHBOURHOOD_TABLES = {}
+
+
+def discretize(values, binWidth=25, binCount=None):
+    """
+    Discretize the gray levels of each window as pyradiomics does (see radiomics.imageoperations.getBinEdges), but for
+    all the windows at once.
+
+    Params
+    ------
+    values : array of shape (nwindows, nvoxels)
+        Gray levels of the voxels of each window, one window per row.
+    binWidth : float
+        With a fixed bin width the bins are equally spaced from 0, then the discretized gray level of a voxel is
+        floor(x / binWidth) - floor(min / binWidth) + 1, with min the minimum gray level of its window.
+    binCount : int or None
+        If it is not None, a fixed amount of bins between the minimum and the maximum of each window is used instead
+        of binWidth.
+
+    Returns
+    -------
+    An int array with the same shape than values, where the lowest gray level of each window is 1.
+    """
+    if binCount is not None:
+        minimum = values.min(axis=1, keepdims=True)
+        maximum = values.max(axis=1, keepdims=True)
+        flat = minimum == maximum
+        # For a flat window numpy.histogram uses the range [min - 0.5, min + 0.5].
+        low = np.where(flat, minimum - 0.5, minimum)
+        width = np.where(flat, 1.0, maximum - minimum)
+        levels = np.floor((values - low) * binCount / width).astype(np.int64) + 1
+        return np.clip(levels, 1, binCount)
+
+    levels = np.floor(values / binWidth).astype(np.int64)
+    return levels - levels.min(axis=1, keepdims=True) + 1
+
+
+def discretize_volume(volume, binWidth=25):
+    """
+    Discretize the whole volume once with a fixed bin width, as floor(x / binWidth) shifted to start at 0, and store
+    it with the smallest unsigned int type that fits (usually uint8 or uint16). Since the bins are equally spaced from
+    0, the gray levels of a window are the ones of this volume minus the minimum of the window plus 1 (see
+    rebase_levels()), exactly as discretize() would give for the window alone.
+
+    It is not possible with binCount, because then the bins depend on the range of each window.
+    """
+    levels = np.floor(volume / binWidth)
+    levels -= levels.min()
+    return levels.astype(np.min_scalar_type(int(levels.max())))
+
+
+def rebase_levels(levelCubes):
+    """
+    Turn the gray levels of a block of windows (nwindows, w, w, w) taken from discretize_volume() into the gray levels
+    of discretize(), where the lowest gray level of each window is 1.
+    """
+    nwindows = levelCubes.shape[0]
+    flat = levelCubes.reshape(nwindows, -1).astype(np.int64)
+    return (flat - flat.min(axis=1, keepdims=True) + 1).reshape(levelCubes.shape)
+
+
+def gray_level_histogram(levels):
+    """
+    Count the voxels of each gray level for all the windows with only one call to np.bincount.
+
+    Params
+    ------
+    levels : int array of shape (nwindows, nvoxels), with gray levels from 1 (see discretize()).
+
+    Returns
+    -------
+    An array of shape (nwindows, Ng + 1), where column g has the amount of voxels with gray level g in each window.
+    """
+    nwindows = levels.shape[0]
+    ng = int(levels.max()) + 1
+    offset = np.arange(nwindows, dtype=np.int64)[:, np.newaxis] * ng
+    return np.bincount((levels + offset).ravel(), minlength=nwindows * ng).reshape(nwindows, ng)
+
+
+def firstorder_features(values, levels, featureNames, voxelArrayShift=0, voxelVolume=1.0):
+    """
+    Compute the first order features of pyradiomics (radiomics.firstorder) for all the windows at once.
+
+    Params
+    ------
+    values : array of shape (nwindows, nvoxels) with the original gray levels, one window per row.
+    levels : int array of shape (nwindows, nvoxels) with the discretized gray levels (see discretize()).
+    featureNames : list with the names of the features to compute, e.g. ['Mean', 'Variance'].
+    voxelArrayShift : value added to the gray levels to compute Energy, TotalEnergy and RootMeanSquared.
+    voxelVolume : volume of a voxel, used to compute TotalEnergy.
+
+    Returns
+    -------
+    An OrderedDict with a vector of length nwindows for each name in featureNames.
+    """
+    values = values.astype(np.float64)
+    nvoxels = values.shape[1]
+
+    mean = values.mean(axis=1)
+    deviation = values - mean[:, np.newaxis]
+    m2 = (deviation ** 2).mean(axis=1)
+
+    histogram = gray_level_histogram(levels)
+    p_i = histogram / float(nvoxels)
+
+    features = OrderedDict()
+    for name in featureNames:
+        if name == 'Energy':
+            features[name] = ((values + voxelArrayShift) ** 2).sum(axis=1)
+        elif name == 'TotalEnergy':
+            features[name] = ((values + voxelArrayShift) ** 2).sum(axis=1) * voxelVolume
+        elif name == 'Entropy':
+            # empty bins do not contribute to the sum, as in pyradiomics where only the present gray levels are used.
+            features[name] = -1.0 * (p_i * np.log2(p_i + np.spacing(1))).sum(axis=1)
+        elif name == 'Minimum':
+            features[name] = values.min(axis=1)
+        elif name == '10Percentile':
+            features[name] = np.percentile(values, 10, axis=1)
+        elif name == '90Percentile':
+            features[name] = np.percentile(values, 90, axis=1)
+        elif name == 'Maximum':
+            features[name] = values.max(axis=1)
+        elif name == 'Mean':
+            features[name] = mean
+        elif name == 'Median':
+            features[name] = np.median(values, axis=1)
+        elif name == 'InterquartileRange':
+            features[name] = np.percentile(values, 75, axis=1) - np.percentile(values, 25, axis=1)
+        elif name == 'Range':
+            features[name] = values.max(axis=1) - values.min(axis=1)
+        elif name == 'MeanAbsoluteDeviation':
+            features[name] = np.abs(deviation).mean(axis=1)
+        elif name == 'RobustMeanAbsoluteDeviation':
+            # only the voxels between the 10th and the 90th percentiles (both included) are used.
+            prcnt10 = np.percentile(values, 10, axis=1)[:, np.newaxis]
+            prcnt90 = np.percentile(values, 90, axis=1)[:, np.newaxis]
+            inside = (values >= prcnt10) & (values <= prcnt90)
+            ninside = inside.sum(axis=1)
+            robust_mean = (values * inside).sum(axis=1) / ninside
+            features[name] = (np.abs(values - robust_mean[:, np.newaxis]) * inside).sum(axis=1) / ninside
+        elif name == 'RootMeanSquared':
+            features[name] = np.sqrt(((values + voxelArrayShift) ** 2).sum(axis=1) / nvoxels)
+        elif name == 'StandardDeviation':
+            features[name] = np.sqrt(m2)
+        elif name == 'Skewness':
+            m3 = (deviation ** 3).mean(axis=1)
+            # Flat regions are returned as 0, as in pyradiomics.
+            features[name] = m3 / np.where(m2 == 0, 1.0, m2) ** 1.5
+        elif name == 'Kurtosis':
+            m4 = (deviation ** 4).mean(axis=1)
+            features[name] = m4 / np.where(m2 == 0, 1.0, m2) ** 2.0
+        elif name == 'Variance':
+            features[name] = m2
+        elif name == 'Uniformity':
+            features[name] = (p_i ** 2).sum(axis=1)
+        else:
+            raise ValueError("Unknown first order feature: '{}'.".format(name))
+
+    return features
+
+
+def box_sums(volume, w):
+    """
+    Sum the volume over every window of w x w x w voxels with steps of 1. Along each axis the sum of a window is the
+    sum of the previous one plus its incoming plane minus its outgoing plane, which is computed for all the windows at
+    once as the difference of two cumulative sums.
+
+    Returns
+    -------
+    An array of shape (Z - w + 1, X - w + 1, Y - w + 1), with the sum of the window that starts at each voxel.
+    """
+    sums = volume.astype(np.float64)
+    for axis in range(3):
+        shape = list(sums.shape)
+        shape[axis] = 1
+        cumulative = np.concatenate([np.zeros(shape), np.cumsum(sums, axis=axis)], axis=axis)
+        n = cumulative.shape[axis]
+        sums = cumulative.take(np.arange(w, n), axis=axis) - cumulative.take(np.arange(0, n - w), axis=axis)
+
+    return sums
+
+
+def sliding_histogram_features(levelVolume, w):
+    """
+    Compute Entropy and Uniformity for every window of w x w x w voxels with steps of 1, sliding the windows along the
+    last axis: the histogram of a window is the one of the previous window minus the gray levels of its outgoing
+    plane plus the ones of its incoming plane, so only the bins that change (at most 2 * w * w) are updated at each
+    step, for all the lines of windows at once.
+
+    Params
+    ------
+    levelVolume : int array with the gray levels of the whole volume, see discretize_volume(). The gray levels of a
+        window do not need to be rebased, since both features only depend on the amount of voxels of each bin.
+
+    Returns
+    -------
+    entropy, uniformity : arrays of shape (Z - w + 1, X - w + 1, Y - w + 1).
+    """
+    eps = np.spacing(1)
+    nvoxels = float(w ** 3)
+    max_z, max_x, max_y = [n - w + 1 for n in levelVolume.shape]
+    nlines = max_z * max_x
+    G = int(levelVolume.max()) + 1
+    line = np.arange(nlines, dtype=np.int64)[:, np.newaxis] * G
+
+    def plane_codes(y):
+        # (line, gray level) codes of the plane y of the windows of every line.
+        planes = np.lib.stride_tricks.sliding_window_view(levelVolume[:, :, y], (w, w))
+        return (line + planes.reshape(nlines, -1)).ravel()
+
+    def entropy_term(count):
+        p = count / nvoxels
+        return p * np.log2(p + eps)
+
+    counts = np.zeros(nlines * G, dtype=np.int64)
+    for y in range(w):
+        counts += np.bincount(plane_codes(y), minlength=nlines * G)
+
+    entropy = np.empty((nlines, max_y), dtype=np.float64)
+    squares = np.empty((nlines, max_y), dtype=np.int64)
+    entropy[:, 0] = entropy_term(counts).reshape(nlines, G).sum(axis=1)
+    squares[:, 0] = (counts ** 2).reshape(nlines, G).sum(axis=1)
+
+    for y in range(1, max_y):
+        outgoing, out_counts = np.unique(plane_codes(y - 1), return_counts=True)
+        incoming, in_counts = np.unique(plane_codes(y + w - 1), return_counts=True)
+        changed = np.union1d(outgoing, incoming)
+        lines = changed // G
+
+        old = counts[changed]
+        counts[outgoing] -= out_counts
+        counts[incoming] += in_counts
+        new = counts[changed]
+
+        entropy[:, y] = entropy[:, y - 1] + np.bincount(lines, weights=entropy_term(new) - entropy_term(old),
+                                                        minlength=nlines)
+        squares[:, y] = squares[:, y - 1] + np.bincount(lines, weights=new ** 2 - old ** 2,
+                                                        minlength=nlines).astype(np.int64)
+
+    entropy = -entropy.reshape(max_z, max_x, max_y)
+    uniformity = squares.reshape(max_z, max_x, max_y) / nvoxels ** 2
+    return entropy, uniformity
+
+
+def sliding_firstorder_features(volume, levelVolume, w, featureNames, voxelArrayShift=0, voxelVolume=1.0):
+    """
+    Compute the first order features of SLIDING_FIRSTORDER for every window of w x w x w voxels with steps of 1,
+    updating each window from the previous one (see box_sums() and sliding_histogram_features()) instead of using all
+    its voxels.
+
+    Params
+    ------
+    volume : array with the original gray levels of the whole (padded) volume.
+    levelVolume : int array with the discretized gray levels of the volume, see discretize_volume().
+    w : size of the window.
+    featureNames : list with the names of the features to compute, all of them in SLIDING_FIRSTORDER.
+
+    Returns
+    -------
+    An OrderedDict with an array of shape (Z - w + 1, X - w + 1, Y - w + 1) for each name in featureNames.
+    """
+    nvoxels = float(w ** 3)
+
+    features = OrderedDict()
+    if 'Entropy' in featureNames or 'Uniformity' in featureNames:
+        entropy, uniformity = sliding_histogram_features(levelVolume, w)
+    if set(featureNames) & {'Energy', 'TotalEnergy', 'RootMeanSquared'}:
+        energy = box_sums((volume.astype(np.float64) + voxelArrayShift) ** 2, w)
+
+    for name in featureNames:
+        if name == 'Energy':
+            features[name] = energy
+        elif name == 'TotalEnergy':
+            features[name] = energy * voxelVolume
+        elif name == 'RootMeanSquared':
+            features[name] = np.sqrt(energy / nvoxels)
+        elif name == 'Mean':
+            features[name] = box_sums(volume, w) / nvoxels
+        elif name == 'Entropy':
+            features[name] = entropy
+        elif name == 'Uniformity':
+            features[name] = uniformity
+        else:
+            raise ValueError("The first order feature '{}' can not be computed sliding the windows.".format(name))
+
+    return features
+
+
+def compact_gray_levels(levels):
+    """
+    Replace the gray levels of each window by their rank among the gray levels present in that window, so the
+    matrices of all the windows have the same small size (at most the number of voxels of a window).
+
+    Params
+    ------
+    levels : int array of shape (nwindows, ...) with the discretized gray levels.
+
+    Returns
+    -------
+    ranks : int array with the same shape than levels, from 0 to (number of gray levels present in the window - 1).
+    grayLevels : float array of shape (nwindows, G) where grayLevels[n, r] is the gray level with rank r in the window
+        n. The ranks that are not present in a window have a gray level of 0.
+    """
+    nwindows = levels.shape[0]
+    flat = levels.reshape(nwindows, -1)
+
+    order = np.argsort(flat, axis=1, kind='stable')
+    sorted_levels = np.take_along_axis(flat, order, axis=1)
+    sorted_ranks = np.zeros(sorted_levels.shape, dtype=np.int64)
+    sorted_ranks[:, 1:] = np.cumsum(np.diff(sorted_levels, axis=1) != 0, axis=1)
+
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+
+    G = int(sorted_ranks.max()) + 1
+    grayLevels = np.zeros((nwindows, G), dtype=np.float64)
+    grayLevels[np.arange(nwindows)[:, np.newaxis], sorted_ranks] = sorted_levels
+
+    return ranks.reshape(levels.shape), grayLevels
+
+
+def neighbour_slices(angle):
+    """
+    Return two tuples of slices for an array of cubes (nwindows, w, w, w): the first one selects the voxels that have
+    a neighbour inside the window at the offset angle = (z, y, x), and the second one selects those neighbours.
+    """
+    source = [slice(None)]
+    target = [slice(None)]
+    for d in angle:
+        if d > 0:
+            source.append(slice(0, -d))
+            target.append(slice(d, None))
+        elif d < 0:
+            source.append(slice(-d, None))
+            target.append(slice(0, d))
+        else:
+            source.append(slice(None))
+            target.append(slice(None))
+
+    return tuple(source), tuple(target)
+
+
+def neighbour_pairs(cubes, angle):
+    """
+    Return two views of the cubes (nwindows, w, w, w): the voxels that have a neighbour inside the window in the
+    direction angle = (z, y, x), and those neighbours.
+    """
+    source, target = neighbour_slices(angle)
+    return cubes[source], cubes[target]
+
+
+def glcm_matrix(ranks, G, symmetrical=True):
+    """
+    Build the gray level co-occurrence matrices of all the windows and the 13 directions with only one call to
+    np.bincount, over the pairs of voxels encoded as ((window * 13 + angle) * G + rank1) * G + rank2.
+
+    Returns
+    -------
+    P_glcm : array of shape (nwindows, G, G, 13), each matrix is normalized to sum 1.
+    """
+    nwindows = ranks.shape[0]
+    nangles = len(ANGLES_3D)
+    window = np.arange(nwindows, dtype=np.int64)[:, np.newaxis, np.newaxis, np.newaxis]
+
+    codes = []
+    for a, angle in enumerate(ANGLES_3D):
+        source, target = neighbour_pairs(ranks, angle)
+        codes.append((((window * nangles + a) * G + source) * G + target).ravel())
+
+    P_glcm = np.bincount(np.concatenate(codes), minlength=nwindows * nangles * G * G).astype(np.float64)
+    P_glcm = P_glcm.reshape(nwindows, nangles, G, G).transpose((0, 2, 3, 1))
+
+    if symmetrical:
+        P_glcm = P_glcm + P_glcm.transpose((0, 2, 1, 3))
+
+    # Normalize each glcm (for windows of at least 2x2x2 voxels there is not any empty angle).
+    return P_glcm / P_glcm.sum(axis=(1, 2), keepdims=True)
+
+
+def sliding_glcm_features(levelVolume, w, featureNames, symmetrical=True, maxCells=MAX_GLCM_CELLS):
+    """
+    Compute the GLCM features for every window of w x w x w voxels with steps of 1, keeping the co-occurrence counts of
+    each line of windows along the last axis: when the window advances one voxel, only the pairs of voxels inside its
+    outgoing plane (or between it and the next plane) are removed and the ones of its incoming plane are added,
+    instead of counting all the pairs of the window again.
+
+    The counts use the gray levels of the whole volume (see discretize_volume()), so each window is rebased to its
+    lowest gray level before computing the features, as discretize() would do.
+
+    Params
+    ------
+    levelVolume : int array with the gray levels of the whole (padded) volume.
+    w : size of the window.
+    featureNames : list with the names of the GLCM features to compute.
+    symmetrical : count each pair in both directions, as the setting symmetricalGLCM of pyradiomics.
+    maxCells : amount of matrix cells kept at once, it bounds the amount of lines of windows processed together.
+
+    Returns
+    -------
+    An OrderedDict with an array of shape (Z - w + 1, X - w + 1, Y - w + 1) for each name in featureNames.
+    """
+    max_z, max_x, max_y = [n - w + 1 for n in levelVolume.shape]
+    nlines = max_z * max_x
+    nangles = len(ANGLES_3D)
+    G = int(levelVolume.max()) + 1
+    blockLines = max(1, min(nlines, maxCells // (nangles * G * G)))
+
+    features = OrderedDict((name, np.empty((nlines, max_y), dtype=np.float64)) for name in featureNames)
+
+    for start in range(0, nlines, blockLines):
+        stop = min(start + blockLines, nlines)
+        line = np.arange(stop - start, dtype=np.int64)[:, np.newaxis, np.newaxis]
+        line_z, line_x = np.divmod(np.arange(start, stop), max_x)
+
+        def plane(c):
+            # the w x w voxels of the column c of every window of the lines.
+            planes = np.lib.stride_tricks.sliding_window_view(levelVolume[:, :, c], (w, w))
+            return planes[line_z, line_x].astype(np.int64)
+
+        def pair_codes(a, source, target):
+            return ((((line * nangles + a) * G + source) * G + target)).ravel()
+
+        def within(c):
+            # pairs of the angles inside a plane (no offset along the last axis) in the column c.
+            current = plane(c)
+            codes = []
+            for a, angle in enumerate(ANGLES_3D):
+                if angle[2] == 0:
+                    source, target = neighbour_slices(angle[:2])
+                    codes.append(pair_codes(a, current[source], current[target]))
+            return np.concatenate(codes)
+
+        def between(c):
+            # pairs of the other angles, between the columns c and c + 1.
+            current, following = plane(c), plane(c + 1)
+            codes = []
+            for a, angle in enumerate(ANGLES_3D):
+                source, target = neighbour_slices(angle[:2])
+                if angle[2] > 0:
+                    codes.append(pair_codes(a, current[source], following[target]))
+                elif angle[2] < 0:
+                    codes.append(pair_codes(a, following[source], current[target]))
+            return np.concatenate(codes)
+
+        length = (stop - start) * nangles * G * G
+        counts = np.bincount(np.concatenate([within(c) for c in range(w)] + [between(c) for c in range(w - 1)]),
+                             minlength=length)
+
+        for y in range(max_y):
+            if y > 0:
+                # remove the pairs of the outgoing column and add the ones of the incoming column.
+                counts -= np.bincount(np.concatenate([within(y - 1), between(y - 1)]), minlength=length)
+                counts += np.bincount(np.concatenate([within(y + w - 1), between(y + w - 2)]), minlength=length)
+
+            # The gray levels of the volume that are present in each window are compacted to their rank (ascending,
+            # the ranks up to the largest amount of gray levels of a window point to absent ones), then the features
+            # are computed over matrices of the size of the ones of compact_gray_levels() instead of G x G.
+            P_volume = counts.reshape(stop - start, nangles, G, G)
+            present = (P_volume.sum(axis=(1, 3)) > 0) | (P_volume.sum(axis=(1, 2)) > 0)
+            Gc = int(present.sum(axis=1).max())
+            order = np.argsort(~present, axis=1, kind='stable')[:, :Gc]
+            lines = np.arange(stop - start)[:, np.newaxis, np.newaxis]
+            P_glcm = P_volume[lines, :, order[:, :, np.newaxis], order[:, np.newaxis, :]].astype(np.float64)
+            if symmetrical:
+                P_glcm = P_glcm + P_glcm.transpose((0, 2, 1, 3))
+
+            # The gray levels of each window are rebased to its lowest one, as discretize() would do.
+            valid = np.take_along_axis(present, order, axis=1)
+            grayLevels = np.where(valid, order - order[:, :1] + 1, 0).astype(np.float64)
+
+            P_glcm /= P_glcm.sum(axis=(1, 2), keepdims=True)
+            for name, value in glcm_features(P_glcm, grayLevels, featureNames).items():
+                features[name][start:stop, y] = value
+
+    return OrderedDict((name, value.reshape(max_z, max_x, max_y)) for name, value in features.items())
+
+
+def weighted_histogram(values, weights, length):
+    """
+    For each window and angle, sum the weights (nwindows, G, G, nangles) of the cells with the same int value
+    (nwindows, G, G). It returns an array of shape (nwindows, length, nangles).
+    """
+    nwindows, _, _, nangles = weights.shape
+    window = np.arange(nwindows, dtype=np.int64)[:, np.newaxis, np.newaxis, np.newaxis]
+    angle = np.arange(nangles, dtype=np.int64)[np.newaxis, np.newaxis, np.newaxis, :]
+
+    codes = (window * length + values[:, :, :, np.newaxis]) * nangles + angle
+    histogram = np.bincount(codes.ravel(), weights=weights.ravel(), minlength=nwindows * length * nangles)
+    return histogram.reshape(nwindows, length, nangles)
+
+
+def glcm_features(P_glcm, grayLevels, featureNames):
+    """
+    Compute the GLCM features of pyradiomics (radiomics.glcm) for all the windows at once. Each feature is computed
+    for every angle and then averaged over the angles.
+
+    Params
+    ------
+    P_glcm : array of shape (nwindows, G, G, nangles), see glcm_matrix().
+    grayLevels : array of shape (nwindows, G) with the gray level of each rank, see compact_gray_levels().
+    featureNames : list with the names of the features to compute.
+
+    Returns
+    -------
+    An OrderedDict with a vector of length nwindows for each name in featureNames.
+    """
+    eps = np.spacing(1)
+
+    i = grayLevels[:, :, np.newaxis, np.newaxis]
+    j = grayLevels[:, np.newaxis, :, np.newaxis]
+    Ng = grayLevels.max(axis=1)     # maximum gray level of each window.
+
+    px = P_glcm.sum(2, keepdims=True)
+    py = P_glcm.sum(1, keepdims=True)
+    ux = (i * P_glcm).sum((1, 2), keepdims=True)
+    uy = (j * P_glcm).sum((1, 2), keepdims=True)
+
+    # Probabilities of the sum and of the absolute difference of the gray levels, by value.
+    maxLevel = int(grayLevels.max())
+    sumLevels = (i + j)[:, :, :, 0].astype(np.int64)
+    diffLevels = np.abs(i - j)[:, :, :, 0].astype(np.int64)
+    pxAddy = weighted_histogram(sumLevels, P_glcm, 2 * maxLevel + 1)
+    pxSuby = weighted_histogram(diffLevels, P_glcm, maxLevel + 1)
+    kValuesSum = np.arange(2 * maxLevel + 1, dtype=np.float64)[np.newaxis, :, np.newaxis]
+    kValuesDiff = np.arange(maxLevel + 1, dtype=np.float64)[np.newaxis, :, np.newaxis]
+
+    HXY = (-1) * (P_glcm * np.log2(P_glcm + eps)).sum((1, 2))
+
+    features = OrderedDict()
+    for name in featureNames:
+        if name == 'Autocorrelation':
+            value = (P_glcm * (i * j)).sum((1, 2))
+        elif name == 'JointAverage':
+            value = ux[:, 0, 0, :]
+        elif name == 'ClusterProminence':
+            value = (P_glcm * ((i + j - ux - uy) ** 4)).sum((1, 2))
+        elif name == 'ClusterShade':
+            value = (P_glcm * ((i + j - ux - uy) ** 3)).sum((1, 2))
+        elif name == 'ClusterTendency':
+            value = (P_glcm * ((i + j - ux - uy) ** 2)).sum((1, 2))
+        elif name == 'Contrast':
+            value = (P_glcm * ((i - j) ** 2)).sum((1, 2))
+        elif name == 'Correlation':
+            sigx = ((P_glcm * ((i - ux) ** 2)).sum((1, 2))) ** 0.5
+            sigy = ((P_glcm * ((j - uy) ** 2)).sum((1, 2))) ** 0.5
+            corm = (P_glcm * (i - ux) * (j - uy)).sum((1, 2))
+            value = corm / (sigx * sigy + eps)
+            value[sigx * sigy == 0] = 1     # Set elements that would be divided by 0 to 1.
+        elif name == 'DifferenceAverage':
+            value = (kValuesDiff * pxSuby).sum(1)
+        elif name == 'DifferenceEntropy':
+            value = (-1) * (pxSuby * np.log2(pxSuby + eps)).sum(1)
+        elif name == 'DifferenceVariance':
+            diffavg = (kValuesDiff * pxSuby).sum(1, keepdims=True)
+            value = (pxSuby * ((kValuesDiff - diffavg) ** 2)).sum(1)
+        elif name == 'JointEnergy':
+            value = (P_glcm ** 2).sum((1, 2))
+        elif name == 'JointEntropy':
+            value = HXY
+        elif name == 'Imc1':
+            HX = (-1) * (px * np.log2(px + eps)).sum((1, 2))
+            HY = (-1) * (py * np.log2(py + eps)).sum((1, 2))
+            HXY1 = (-1) * (P_glcm * np.log2(px * py + eps)).sum((1, 2))
+            div = np.fmax(HX, HY)
+            value = np.where(div != 0, (HXY - HXY1) / np.where(div != 0, div, 1), 0)
+        elif name == 'Imc2':
+            HXY2 = (-1) * ((px * py) * np.log2(px * py + eps)).sum((1, 2))
+            value = (1 - np.e ** (-2 * (HXY2 - HXY))) ** 0.5
+            value[HXY2 == HXY] = 0
+        elif name == 'Idm':
+            value = (pxSuby / (1 + kValuesDiff ** 2)).sum(1)
+        elif name == 'MCC':
+            # Q(i, j) = sum_k P(i, k) * P(j, k) / (px(i) * py(k)), its eigenvalues are computed for all the windows
+            # and angles at once. The ranks that are not present in a window only add eigenvalues equal to 0.
+            A = P_glcm / (px * py + eps)
+            Q = np.einsum('nika,njka->naij', A, P_glcm)
+            eigenValues = np.sort(np.linalg.eigvals(Q), axis=-1)
+            if eigenValues.shape[-1] < 2:
+                value = np.ones(P_glcm.shape[0])[:, np.newaxis]
+            else:
+                value = np.sqrt(eigenValues[:, :, -2])
+                # Windows with only one gray level (flat regions) are returned as 1, as in pyradiomics.
+                value[(grayLevels > 0).sum(axis=1) < 2] = 1
+        elif name == 'Idmn':
+            value = (pxSuby / (1 + ((kValuesDiff ** 2) / (Ng[:, np.newaxis, np.newaxis] ** 2)))).sum(1)
+        elif name == 'Id':
+            value = (pxSuby / (1 + kValuesDiff)).sum(1)
+        elif name == 'Idn':
+            value = (pxSuby / (1 + (kValuesDiff / Ng[:, np.newaxis, np.newaxis]))).sum(1)
+        elif name == 'InverseVariance':
+            value = (pxSuby[:, 1:, :] / kValuesDiff[:, 1:, :] ** 2).sum(1)    # Skip k = 0 (division by 0)
+        elif name == 'MaximumProbability':
+            value = P_glcm.max((1, 2))
+        elif name == 'SumAverage':
+            value = (kValuesSum * pxAddy).sum(1)
+        elif name == 'SumEntropy':
+            value = (-1) * (pxAddy * np.log2(pxAddy + eps)).sum(1)
+        elif name == 'SumSquares':
+            value = (P_glcm * ((i - ux) ** 2)).sum((1, 2))
+        else:
+            raise ValueError("Unknown GLCM feature: '{}'.".format(name))
+
+        features[name] = np.real(value.mean(axis=-1))
+
+    return features
+
+
+def glrlm_matrix(ranks, G):
+    """
+    Build the gray level run length matrices of all the windows and the 13 directions at once. For each direction, a
+    voxel continues a run when its previous voxel has the same gray level, the length of the run that ends in each
+    voxel is accumulated with w shifted masks, and every run is counted once in the voxel where it ends, with only
+    one call to np.bincount.
+
+    Returns
+    -------
+    P_glrlm : array of shape (nwindows, G, w, 13), where P_glrlm[n, r, l - 1, a] is the amount of runs of length l
+        with the gray level of rank r in the window n along the angle a.
+    """
+    nwindows = ranks.shape[0]
+    nangles = len(ANGLES_3D)
+    Nr = max(ranks.shape[1:])   # the longest run allowed in a window.
+    window = np.arange(nwindows, dtype=np.int64)[:, np.newaxis, np.newaxis, np.newaxis]
+
+    codes = []
+    for a, angle in enumerate(ANGLES_3D):
+        source, target = neighbour_slices(angle)
+
+        # same[p]: the voxel p - angle is inside the window and has the same gray level than p.
+        same = np.zeros(ranks.shape, dtype=bool)
+        same[target] = ranks[source] == ranks[target]
+
+        # length[p]: length of the run from its first voxel to p.
+        length = np.ones(ranks.shape, dtype=np.int64)
+        consecutive = same.copy()
+        for m in range(1, Nr):
+            length += consecutive
+            if m < Nr - 1:
+                previous = np.zeros(ranks.shape, dtype=bool)
+                source_m, target_m = neighbour_slices([m * d for d in angle])
+                previous[target_m] = same[source_m]
+                consecutive &= previous
+
+        # A run ends in p when p + angle is outside the window or it has another gray level.
+        end = np.ones(ranks.shape, dtype=bool)
+        end[source] = ~same[target]
+
+        codes.append(((((window * nangles + a) * G + ranks) * Nr + length - 1)[end]))
+
+    P_glrlm = np.bincount(np.concatenate(codes), minlength=nwindows * nangles * G * Nr).astype(np.float64)
+    return P_glrlm.reshape(nwindows, nangles, G, Nr).transpose((0, 2, 3, 1))
+
+
+def glrlm_features(P_glrlm, grayLevels, featureNames):
+    """
+    Compute the GLRLM features of pyradiomics (radiomics.glrlm) for all the windows at once. Each feature is computed
+    for every angle and then averaged over the angles.
+
+    Params
+    ------
+    P_glrlm : array of shape (nwindows, G, Nr, nangles), see glrlm_matrix().
+    grayLevels : array of shape (nwindows, G) with the gray level of each rank, see compact_gray_levels().
+    featureNames : list with the names of the features to compute.
+
+    Returns
+    -------
+    An OrderedDict with a vector of length nwindows for each name in featureNames.
+    """
+    eps = np.spacing(1)
+
+    # The ranks that are not present in a window have not any run, any gray level != 0 avoids dividing by 0.
+    ivector = np.where(grayLevels > 0, grayLevels, 1.0)[:, :, np.newaxis]           # shape (nwindows, G, 1)
+    jvector = np.arange(1, P_glrlm.shape[2] + 1, dtype=np.float64)[np.newaxis, :, np.newaxis]  # shape (1, Nr, 1)
+
+    Nr = P_glrlm.sum((1, 2))    # amount of runs, shape (nwindows, nangles)
+    pr = P_glrlm.sum(1)         # shape (nwindows, Nr, nangles)
+    pg = P_glrlm.sum(2)         # shape (nwindows, G, nangles)
+
+    features = OrderedDict()
+    for name in featureNames:
+        if name == 'ShortRunEmphasis':
+            value = (pr / (jvector ** 2)).sum(1) / Nr
+        elif name == 'LongRunEmphasis':
+            value = (pr * (jvector ** 2)).sum(1) / Nr
+        elif name == 'GrayLevelNonUniformity':
+            value = (pg ** 2).sum(1) / Nr
+        elif name == 'GrayLevelNonUniformityNormalized':
+            value = (pg ** 2).sum(1) / (Nr ** 2)
+        elif name == 'RunLengthNonUniformity':
+            value = (pr ** 2).sum(1) / Nr
+        elif name == 'RunLengthNonUniformityNormalized':
+            value = (pr ** 2).sum(1) / (Nr ** 2)
+        elif name == 'RunPercentage':
+            value = Nr / (pr * jvector).sum(1)
+        elif name == 'GrayLevelVariance':
+            p_g = pg / Nr[:, np.newaxis, :]
+            u_i = (p_g * ivector).sum(1, keepdims=True)
+            value = (p_g * (ivector - u_i) ** 2).sum(1)
+        elif name == 'RunVariance':
+            p_r = pr / Nr[:, np.newaxis, :]
+            u_j = (p_r * jvector).sum(1, keepdims=True)
+            value = (p_r * (jvector - u_j) ** 2).sum(1)
+        elif name == 'RunEntropy':
+            p_glrlm = P_glrlm / Nr[:, np.newaxis, np.newaxis, :]
+            value = -(p_glrlm * np.log2(p_glrlm + eps)).sum((1, 2))
+        elif name == 'LowGrayLevelRunEmphasis':
+            value = (pg / (ivector ** 2)).sum(1) / Nr
+        elif name == 'HighGrayLevelRunEmphasis':
+            value = (pg * (ivector ** 2)).sum(1) / Nr
+        elif name == 'ShortRunLowGrayLevelEmphasis':
+            value = (P_glrlm / ((ivector[:, :, :, np.newaxis] ** 2) * (jvector[:, np.newaxis] ** 2))).sum((1, 2)) / Nr
+        elif name == 'ShortRunHighGrayLevelEmphasis':
+            value = (P_glrlm * (ivector[:, :, :, np.newaxis] ** 2) / (jvector[:, np.newaxis] ** 2)).sum((1, 2)) / Nr
+        elif name == 'LongRunLowGrayLevelEmphasis':
+            value = (P_glrlm * (jvector[:, np.newaxis] ** 2) / (ivector[:, :, :, np.newaxis] ** 2)).sum((1, 2)) / Nr
+        elif name == 'LongRunHighGrayLevelEmphasis':
+            value = (P_glrlm * ((jvector[:, np.newaxis] ** 2) * (ivector[:, :, :, np.newaxis] ** 2))).sum((1, 2)) / Nr
+        else:
+            raise ValueError("Unknown GLRLM feature: '{}'.".format(name))
+
+        features[name] = value.mean(axis=-1)
+
+    return features
+
+
+def neighbourhood_table(shape):
+    """
+    Return the neighbourhood of a window of the given shape (w, w, w) as a list with a pair of arrays (source, target)
+    of flat voxel indices for each of the 13 angles, where target[k] is the neighbour of source[k] at that angle. The
+    other 13 directions of the 26-connectivity are the same pairs swapped. The topology is the same for every window,
+    so the table is built only once per shape.
+    """
+    shape = tuple(shape)
+    if shape not in _NEIGHBOURHOOD_TABLES:
+        index = np.arange(np.prod(shape)).reshape(shape)
+        table = []
+        for angle in ANGLES_3D:
+            source, target = neighbour_slices(angle)
+            table.append((index[source[1:]].ravel(), index[target[1:]].ravel()))
+        _NEIGHBOURHOOD_TABLES[shape] = table
+
+    return _NEIGHBOURHOOD_TABLES[shape]
+
+
+def matrix_cells(window, rows, cols):
+    """
+    Count the entries with the same (window, row, col), like a sparse matrix per window.
+
+    Returns
+    -------
+    Four vectors with one element per non empty cell: window, row, col and the amount of entries in the cell.
+    """
+    nrows = int(rows.max()) + 1
+    ncols = int(cols.max()) + 1
+    codes, counts = np.unique((window * nrows + rows) * ncols + cols, return_counts=True)
+    return codes // (nrows * ncols), (codes // ncols) % nrows, codes % ncols, counts.astype(np.float64)
+
+
+def zone_labels(ranks, table):
+    """
+    Label the connected zones (26-connectivity, same gray level) of all the windows at once. Every voxel starts with
+    its own index as label, then each voxel takes the lowest label of its neighbours with the same gray level and the
+    labels are shortened by pointer jumping (label = label[label]), until they do not change anymore.
+
+    Params
+    ------
+    ranks : int array of shape (nwindows, nvoxels) with the gray levels of each window, one window per row.
+    table : list of (source, target) pairs of flat indices, see neighbourhood_table().
+
+    Returns
+    -------
+    An int array of shape (nwindows, nvoxels) with, for each voxel, the index of the first voxel of its zone.
+    """
+    nwindows, nvoxels = ranks.shape
+    same = [ranks[:, source] == ranks[:, target] for source, target in table]
+    labels = np.tile(np.arange(nvoxels, dtype=np.int64), (nwindows, 1))
+
+    while True:
+        previous = labels.copy()
+        for (source, target), connected in zip(table, same):
+            labels[:, source] = np.minimum(labels[:, source], np.where(connected, labels[:, target], nvoxels))
+            labels[:, target] = np.minimum(labels[:, target], np.where(connected, labels[:, source], nvoxels))
+        labels = np.take_along_axis(labels, labels, axis=1)
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def glszm_cells(ranks):
+    """
+    Find the zones of all the windows (nwindows, w, w, w) and return their gray level size zone matrices as cells,
+    see matrix_cells(): (window, gray level rank, zone size, amount of zones).
+    """
+    nwindows = ranks.shape[0]
+    flat = ranks.reshape(nwindows, -1)
+    nvoxels = flat.shape[1]
+
+    labels = zone_labels(flat, neighbourhood_table(ranks.shape[1:]))
+    window = np.repeat(np.arange(nwindows, dtype=np.int64), nvoxels).reshape(nwindows, nvoxels)
+    sizes = np.bincount((window * nvoxels + labels).ravel(), minlength=nwindows * nvoxels).reshape(nwindows, nvoxels)
+
+    # Every zone is counted once, in the voxel that gives its label.
+    first = labels == np.arange(nvoxels)
+    return matrix_cells(window[first], flat[first], sizes[first])
+
+
+def gldm_cells(ranks, levels, alpha=0):
+    """
+    Compute the dependence of every voxel of all the windows (nwindows, w, w, w): 1 plus the amount of neighbours
+    (26-connectivity) whose gray level differs at most alpha from its own, and return the gray level dependence
+    matrices as cells, see matrix_cells(): (window, gray level rank, dependence, amount of voxels).
+    """
+    nwindows = ranks.shape[0]
+    flat = levels.reshape(nwindows, -1)
+    nvoxels = flat.shape[1]
+
+    dependence = np.ones(flat.shape, dtype=np.int64)
+    for source, target in neighbourhood_table(ranks.shape[1:]):
+        dependent = np.abs(flat[:, source] - flat[:, target]) <= alpha
+        dependence[:, source] += dependent
+        dependence[:, target] += dependent
+
+    window = np.repeat(np.arange(nwindows, dtype=np.int64), nvoxels)
+    return matrix_cells(window, ranks.reshape(-1), dependence.ravel())
+
+
+def size_matrix_features(cells, grayLevels, featureNames, generic):
+    """
+    Compute the GLSZM or the GLDM features of pyradiomics (radiomics.glszm and radiomics.gldm) for all the windows
+    at once, from the non empty cells of their matrices. The empty rows and columns that pyradiomics deletes do not
+    change any feature, so only the cells are used.
+
+    Params
+    ------
+    cells : (window, gray level rank, size, count) vectors, see glszm_cells() and gldm_cells().
+    grayLevels : array of shape (nwindows, G) with the gray level of each rank, see compact_gray_levels().
+    featureNames : list with the names of the features to compute.
+    generic : dict {feature name: generic name}, GLSZM_GENERIC or GLDM_GENERIC.
+
+    Returns
+    -------
+    An OrderedDict with a vector of length nwindows for each name in featureNames.
+    """
+    eps = np.spacing(1)
+    window, rank, size, count = cells
+    nwindows, G = grayLevels.shape
+    S = int(size.max()) + 1
+
+    i = grayLevels[window, rank]
+    j = size.astype(np.float64)
+
+    def per_window(weights):
+        return np.bincount(window, weights=weights, minlength=nwindows)
+
+    Nz = per_window(count)
+    pg = np.bincount(window * G + rank, weights=count, minlength=nwindows * G).reshape(nwindows, G)
+    ps = np.bincount(window * S + size, weights=count, minlength=nwindows * S).reshape(nwindows, S)
+
+    features = OrderedDict()
+    for name in featureNames:
+        if name not in generic:
+            raise ValueError("Unknown feature: '{}'.".format(name))
+        feature = generic[name]
+
+        if feature == 'SmallEmphasis':
+            value = per_window(count / j ** 2) / Nz
+        elif feature == 'LargeEmphasis':
+            value = per_window(count * j ** 2) / Nz
+        elif feature == 'GrayLevelNonUniformity':
+            value = (pg ** 2).sum(1) / Nz
+        elif feature == 'GrayLevelNonUniformityNormalized':
+            value = (pg ** 2).sum(1) / Nz ** 2
+        elif feature == 'SizeNonUniformity':
+            value = (ps ** 2).sum(1) / Nz
+        elif feature == 'SizeNonUniformityNormalized':
+            value = (ps ** 2).sum(1) / Nz ** 2
+        elif feature == 'Percentage':
+            value = Nz / per_window(count * j)
+        elif feature == 'GrayLevelVariance':
+            u_i = per_window(count * i) / Nz
+            value = per_window(count * (i - u_i[window]) ** 2) / Nz
+        elif feature == 'SizeVariance':
+            u_j = per_window(count * j) / Nz
+            value = per_window(count * (j - u_j[window]) ** 2) / Nz
+        elif feature == 'Entropy':
+            p = count / Nz[window]
+            value = -per_window(p * np.log2(p + eps))
+        elif feature == 'LowGrayLevelEmphasis':
+            value = per_window(count / i ** 2) / Nz
+        elif feature == 'HighGrayLevelEmphasis':
+            value = per_window(count * i ** 2) / Nz
+        elif feature == 'SmallLowGrayLevelEmphasis':
+            value = per_window(count / (i ** 2 * j ** 2)) / Nz
+        elif feature == 'SmallHighGrayLevelEmphasis':
+            value = per_window(count * i ** 2 / j ** 2) / Nz
+        elif feature == 'LargeLowGrayLevelEmphasis':
+            value = per_window(count * j ** 2 / i ** 2) / Nz
+        elif feature == 'LargeHighGrayLevelEmphasis':
+            value = per_window(count * j ** 2 * i ** 2) / Nz
+
+        features[name] = value
+
+    return features
+
+
+# Feature classes implemented in this module: {name: (default features, deprecated features, function)}.
+# All the functions receive: cubes (nwindows, w, w, w), levels (nwindows, w, w, w), featureNames and settings.
+def _firstorder(cubes, levels, featureNames, settings):
+    nwindows = cubes.shape[0]
+    return firstorder_features(cubes.reshape(nwindows, -1), levels.reshape(nwindows, -1), featureNames,
+                               voxelArrayShift=settings.get('voxelArrayShift', 0))
+
+
+def _glcm(cubes, levels, featureNames, settings):
+    if settings.get('weightingNorm') is not None:
+        raise ValueError("The GLCM weighting '{}' is not supported.".format(settings.get('weightingNorm')))
+
+    ranks, grayLevels = compact_gray_levels(levels)
+    nwindows = ranks.shape[0]
+    blockWindows = max(1, MAX_GLCM_CELLS // (len(ANGLES_3D) * grayLevels.shape[1] ** 2))
+
+    features = OrderedDict()
+    for start in range(0, nwindows, blockWindows):
+        stop = min(start + blockWindows, nwindows)
+        G = int(ranks[start:stop].max()) + 1   # the gray levels of this block only.
+        P_glcm = glcm_matrix(ranks[start:stop], G, settings.get('symmetricalGLCM', True))
+        for name, value in glcm_features(P_glcm, grayLevels[start:stop, :G], featureNames).items():
+            if name not in features:
+                features[name] = np.empty(nwindows, dtype=np.float64)
+            features[name][start:stop] = value
+        del P_glcm
+
+    return features
+
+
+def _glrlm(cubes, levels, featureNames, settings):
+    if settings.get('weightingNorm') is not None:
+        raise ValueError("The GLRLM weighting '{}' is not supported.".format(settings.get('weightingNorm')))
+
+    ranks, grayLevels = compact_gray_levels(levels)
+    P_glrlm = glrlm_matrix(ranks, grayLevels.shape[1])
+    return glrlm_features(P_glrlm, grayLevels, featureNames)
+
+
+def _glszm(cubes, levels, featureNames, settings):
+    ranks, grayLevels = compact_gray_levels(levels)
+    return size_matrix_features(glszm_cells(ranks), grayLevels, featureNames, GLSZM_GENERIC)
+
+
+def _gldm(cubes, levels, featureNames, settings):
+    ranks, grayLevels = compact_gray_levels(levels)
+    cells = gldm_cells(ranks, levels, settings.get('gldm_a', 0))
+    return size_matrix_features(cells, grayLevels, featureNames, GLDM_GENERIC)
+
+
+FEATURE_CLASSES = OrderedDict([('firstorder', (FIRSTORDER_FEATURES, FIRSTORDER_DEPRECATED, _firstorder)),
+                               ('glcm', (GLCM_FEATURES, [], _glcm)),
+                               ('glrlm', (GLRLM_FEATURES, [], _glrlm)),
+                               ('glszm', (GLSZM_FEATURES, [], _glszm)),
+                               ('gldm', (GLDM_FEATURES, [], _gldm))])
+
+
+def enabled_feature_names(featureClass, enabled):
+    """
+    Return the names of the features to compute for featureClass, where enabled is the list from the parameters file
+    (an empty list or None means all the features that are not deprecated).
+    """
+    default, deprecated, _ = FEATURE_CLASSES[featureClass]
+
+    if not enabled:
+        return list(default)
+
+    for name in enabled:
+        if name not in default and name not in deprecated:
+            raise ValueError("The feature '{}' of the class '{}' is not supported.".format(name, featureClass))
+
+    return list(enabled)
+
+
+def extract(cubes, enabledFeatures, settings, levels=None, profile=None):
+    """
+    Compute the features of all the cubes at once.
+
+    Params
+    ------
+    cubes : array of shape (nwindows, w, w, w) with the windows to process.
+    enabledFeatures : dict {featureClass: list of feature names}, as in the parameters file of pyradiomics.
+    settings : dict with the settings of pyradiomics (binWidth, binCount, voxelArrayShift, ...).
+    levels : int array with the same shape than cubes and the discretized gray levels (see rebase_levels()), or None to
+        discretize the cubes here.
+    profile : FeatureClassProfile where the time of each feature class is accumulated, or None.
+
+    Returns
+    -------
+    An OrderedDict {'original_<featureClass>_<featureName>': vector of length nwindows}, with the same names than
+    pyradiomics, ordered by name.
+    """
+    if levels is None:
+        nwindows = cubes.shape[0]
+        levels = discretize(cubes.reshape(nwindows, -1), settings.get('binWidth', 25), settings.get('binCount'))
+        levels = levels.reshape(cubes.shape)
+
+    features = {}
+    for featureClass, enabled in enabledFeatures.items():
+        _, _, function = FEATURE_CLASSES[featureClass]
+        featureNames = enabled_feature_names(featureClass, enabled)
+        if profile is not None:
+            with profile.measure('original_{}'.format(featureClass)):
+                values = function(cubes, levels, featureNames, settings)
+        else:
+            values = function(cubes, levels, featureNames, settings)
+        for name, value in values.items():
+            features['original_{}_{}'.format(featureClass, name)] = value
+
+    return OrderedDict(sorted(features.items()))
@@ -0,0 +1,129 @@
+import os
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+
+class FileWorkQueue():
+    """
+    Queue of cases shared by several processes or nodes through a directory of a shared filesystem. Each case is an
+    empty file that moves between the folders pending/, claimed/, done/ and failed/ with os.rename, which is atomic:
+    when several workers try to claim the same case, only one rename succeeds. A claimed file is named
+    <case>@<host>-<pid> and its modification time is refreshed while the case is processed (see heartbeat()), so the
+    claims of dead nodes become stale and are moved back to pending/ by any other worker.
+    """
+    def __init__(self, queue_path, stale_time=3600):
+        self.queue_path = queue_path
+        self.stale_time = stale_time    # seconds without heartbeat after which a claim is considered dead.
+        self.owner = '{}-{}'.format(socket.gethostname(), os.getpid())
+
+        for folder in ('pending', 'claimed', 'done', 'failed'):
+            path = os.path.join(self.queue_path, folder)
+            if not os.path.exists(path):
+                os.makedirs(path, exist_ok=True)
+
+    def folder(self, name):
+        return os.path.join(self.queue_path, name)
+
+    def populate(self, cases, wait=60):
+        """
+        Add the cases to pending/. Only the first worker does it (the creation of the folder 'populated' is atomic),
+        the other ones wait until it has finished, then a case is never added again once it has been claimed.
+        """
+        try:
+            os.mkdir(self.folder('populated'))
+        except FileExistsError:
+            start_time = time.time()
+            while not os.path.exists(self.folder('ready')) and time.time() - start_time < wait:
+                time.sleep(1)
+            return
+
+        for case in cases:
+            open(os.path.join(self.folder('pending'), case), 'a').close()
+        open(self.folder('ready'), 'a').close()
+        print("Work queue {}: {} cases added.".format(self.queue_path, len(cases)))
+
+    def claim(self):
+        # It returns (case, path of the claimed file), or None if there is not any pending case.
+        for case in sorted(os.listdir(self.folder('pending'))):
+            pending = os.path.join(self.folder('pending'), case)
+            claimed = os.path.join(self.folder('claimed'), '{}@{}'.format(case, self.owner))
+            try:
+                # The heartbeat is refreshed before the rename: the file keeps the time of populate(), then it would be
+                # stale for requeue_stale() as soon as it arrives to claimed/.
+                os.utime(pending, None)
+                os.rename(pending, claimed)
+                os.utime(claimed, None)
+            except FileNotFoundError:
+                continue    # another worker has claimed it first, or the claim has been re-queued meanwhile.
+
+            return case, claimed
+
+        return None
+
+    def lost(self, claim):
+        # The claimed file is gone: the claim became stale and has been re-queued, then the case belongs to another
+        # worker now and its state must not be changed from here.
+        print("Work queue: the claim {} was lost (re-queued as stale), the case is left to its new owner.".format(
+            os.path.basename(claim[1])))
+        return False
+
+    def complete(self, claim):
+        # It returns False if the claim was lost before the case was completed.
+        case, claimed = claim
+        try:
+            os.rename(claimed, os.path.join(self.folder('done'), case))
+        except FileNotFoundError:
+            return self.lost(claim)
+        return True
+
+    def fail(self, claim, error):
+        # It returns False if the claim was lost before the case failed. The file is opened with 'r+', then a lost
+        # claim is never created again.
+        case, claimed = claim
+        try:
+            with open(claimed, 'r+') as f:
+                f.truncate()
+                f.write(error)
+            os.rename(claimed, os.path.join(self.folder('failed'), case))
+        except FileNotFoundError:
+            return self.lost(claim)
+        return True
+
+    def requeue_stale(self):
+        # Move back to pending/ the claims without heartbeat for more than stale_time seconds.
+        now = time.time()
+        for name in os.listdir(self.folder('claimed')):
+            claimed = os.path.join(self.folder('claimed'), name)
+            try:
+                if now - os.stat(claimed).st_mtime <= self.stale_time:
+                    continue
+                case = name.rsplit('@', 1)[0]
+                os.rename(claimed, os.path.join(self.folder('pending'), case))
+                print("Work queue: the stale claim {} has been re-queued.".format(name))
+            except FileNotFoundError:
+                continue    # completed or re-queued by another worker meanwhile.
+
+    @contextmanager
+    def heartbeat(self, claim):
+        # Refresh the claimed file while the case is processed, then it does not become stale.
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.stale_time / 4.0):
+                try:
+                    os.utime(claim[1], None)
+                except FileNotFoundError:
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def counts(self):
+        return {folder: len(os.listdir(self.folder(folder))) for folder in ('pending', 'claimed', 'done', 'failed')}